@@ -1,6 +1,25 @@
 import asyncio
 import aiofiles
+import os
 import random
+import file_watch
+from pipeline import take_batch
+from scheduling_queue import SchedulingQueue
+import runner
+
+# bytes read at a time when catching up on a file
+READ_CHUNK_SIZE = 1024 * 1024
+# the writer flushes once this many bytes are buffered
+WRITE_BATCH_BYTES = int(os.getenv("WRITE_BATCH_BYTES", str(64 * 1024)))
+# or once the first buffered line has waited this many seconds
+WRITE_BATCH_DELAY = float(os.getenv("WRITE_BATCH_DELAY", "0.05"))
+# durability: none leaves it to the OS, batch fsyncs every flush,
+# interval fsyncs what was written at most FSYNC_INTERVAL seconds after writing it
+FSYNC_POLICIES = ("none", "batch", "interval")
+FSYNC = os.getenv("FSYNC", "none")
+FSYNC_INTERVAL = float(os.getenv("FSYNC_INTERVAL", "1"))
+# seconds generated data may wait to be handled before it is dropped, unset keeps all of it
+ITEM_TTL = float(os.getenv("ITEM_TTL")) if os.getenv("ITEM_TTL") else None
 
 
 # async def read_from_file(filename):
@@ -11,17 +30,70 @@ import random
 #             print(f"reading: {content}")
 
 
+async def follow(filename, from_end=False):
+    """
+    Yield each line appended to a file, like tail -F.
+    Only data past the last offset read is read, and the wait for more is woken by inotify.
+    A truncated file is read again from the start. When the file is rotated (its path now
+    names another inode), the rest of the old file is read before switching to the new one.
+    """
+    watcher = file_watch.watch(filename)
+    file = None
+    # bytes read from the open file, and a trailing line still being written
+    offset = 0
+    partial = b""
+    try:
+        while True:
+            if file is None:
+                try:
+                    file = await aiofiles.open(filename, mode="rb")
+                except FileNotFoundError:
+                    await watcher.wait()
+                    continue
+                offset = 0
+                partial = b""
+                if from_end:
+                    offset = await file.seek(0, os.SEEK_END)
+                    # later files after a rotation are read from their start
+                    from_end = False
+
+            if os.fstat(file.fileno()).st_size < offset:
+                # truncated, start over
+                offset = await file.seek(0)
+                partial = b""
+
+            # read everything appended since the last read
+            while chunk := await file.read(READ_CHUNK_SIZE):
+                offset += len(chunk)
+                lines = (partial + chunk).split(b"\n")
+                partial = lines.pop()
+                for line in lines:
+                    yield line.decode()
+
+            try:
+                rotated = os.stat(filename).st_ino != os.fstat(file.fileno()).st_ino
+            except FileNotFoundError:
+                # moved away, the new file is not there yet
+                rotated = False
+            if rotated:
+                # the old file was read to its end above
+                if partial:
+                    yield partial.decode()
+                await file.close()
+                file = None
+                continue
+
+            await watcher.wait()
+    finally:
+        watcher.close()
+        if file is not None:
+            await file.close()
+
+
 async def read_from_file(filename):
-    while True:
-        async with aiofiles.open(filename, mode="r") as file:
-            # Read the entire file
-            content = await file.read()
-            if content:
-                print(f"reading: {content}")
-            else:
-                print("No new data. Waiting for new data...")
-        # Wait a bit before reopening the file to check for new data
-        await asyncio.sleep(random.random())
+    # only lines written since the last read are printed
+    async for line in follow(filename):
+        print(f"reading: {line}")
 
 
 async def generate_data(n):
@@ -36,7 +108,7 @@ async def generate_data(n):
 async def put_data(queue):
     while True:
         data = await generate_data(100)
-        await queue.put(data)
+        await queue.put(data, ttl=ITEM_TTL)
         # print(f"put: {data}")
 
 
@@ -46,18 +118,80 @@ async def get_data(queue):
         print(f"get: {data}")
 
 
-async def write_to_file(queue, filename):
-    async with aiofiles.open(filename, mode="a+") as file:
-        while True:
-            data = await queue.get()
-            await file.write(str(data) + "\n")
-            print(f"writing: {data}")
+def encode_line(item):
+    return f"{item}\n".encode()
+
+
+async def write_batch(file, lines):
+    """
+    Append the lines with as few writes as possible, one unless the OS writes part of it.
+    """
+    data = memoryview(b"".join(lines))
+    while data:
+        written = await file.write(data)
+        data = data[written:]
+
+
+async def write_to_file(
+    queue,
+    filename,
+    batch_bytes=WRITE_BATCH_BYTES,
+    batch_delay=WRITE_BATCH_DELAY,
+    fsync=FSYNC,
+    fsync_interval=FSYNC_INTERVAL,
+):
+    """
+    Group commit: items arriving together are written, and optionally fsynced, as one batch.
+    A batch is written once batch_bytes are buffered or batch_delay seconds after its first item.
+    """
+    if fsync not in FSYNC_POLICIES:
+        raise ValueError(f"Unknown fsync policy: {fsync}, expected one of {FSYNC_POLICIES}")
+    loop = asyncio.get_running_loop()
+    # when the oldest write not yet fsynced was made, None once everything is synced
+    unsynced = None
+    # unbuffered, each batch is one write to the OS and nothing is left in a buffer
+    async with aiofiles.open(filename, mode="ab", buffering=0) as file:
+        try:
+            while True:
+                if unsynced is None:
+                    item = await queue.get()
+                else:
+                    # the fsync is due even if nothing more is written
+                    try:
+                        item = await asyncio.wait_for(
+                            queue.get(), max(unsynced + fsync_interval - loop.time(), 0)
+                        )
+                    except asyncio.TimeoutError:
+                        await loop.run_in_executor(None, os.fsync, file.fileno())
+                        unsynced = None
+                        continue
+                lines = [encode_line(item)]
+                try:
+                    size = await take_batch(
+                        queue, lines, batch_bytes, batch_delay, prepare=encode_line, measure=len
+                    )
+                finally:
+                    # written even when cancelled, nothing taken from the queue is lost
+                    await write_batch(file, lines)
+                    if fsync == "interval" and unsynced is None:
+                        unsynced = loop.time()
+                    if fsync == "batch" or (
+                        fsync == "interval" and loop.time() - unsynced >= fsync_interval
+                    ):
+                        await loop.run_in_executor(None, os.fsync, file.fileno())
+                        unsynced = None
+                    for _ in lines:
+                        queue.task_done()
+                print(f"writing: {len(lines)} lines, {size} bytes")
+        finally:
+            if unsynced is not None:
+                await loop.run_in_executor(None, os.fsync, file.fileno())
 
 
 async def async_main():
     # with open("data/example.txt", "w") as file:
     #     file.write("First Line \n")
-    queue = asyncio.Queue()
+    queue = SchedulingQueue()
     tasks = [
         put_data(queue),
         # get_data(queue),
@@ -68,4 +202,5 @@ async def async_main():
 
 
 # Example usage
-asyncio.run(async_main())
+if __name__ == "__main__":
+    runner.run(async_main())
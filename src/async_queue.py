@@ -1,6 +1,24 @@
 import asyncio
+import hashlib
+import os
 import random
 import time
+import runner
+from pipeline import Pipeline, ProcessStage, Stage
+from scheduling_queue import SchedulingQueue
+
+# items generated, each by its own producer
+PRODUCERS = int(os.getenv("PRODUCERS", "10"))
+# items handled at the same time
+CONSUMERS = int(os.getenv("CONSUMERS", "1"))
+# items waiting for a consumer, producers wait when it is full
+QUEUE_SIZE = int(os.getenv("QUEUE_SIZE", "100"))
+# seconds an item may wait for a consumer before it is dropped, unset keeps every item
+ITEM_TTL = float(os.getenv("ITEM_TTL")) if os.getenv("ITEM_TTL") else None
+# processes for the CPU bound step, one per CPU by default, 0 runs it on the event loop
+CPU_WORKERS = int(os.getenv("CPU_WORKERS")) if os.getenv("CPU_WORKERS") else None
+# rounds of hashing per item, the CPU bound work
+HASH_ROUNDS = int(os.getenv("HASH_ROUNDS", "100000"))
 
 
 # # put items option 1: has to wait for each number i to be generated
@@ -13,43 +31,60 @@ import time
 
 
 # put items option 2: asyncronously generates data
-async def produce_item(queue, i):
+async def produce_item(pipeline, i):
     r = random.randrange(0, 2)
     if r > 0:
         print(f"Item {i} is sleeping for {r} second(s)")
         await asyncio.sleep(r)
-    await queue.put(i)
+    # producers take turns, and an item left waiting past ITEM_TTL is dropped
+    await pipeline.put(i, key=i, ttl=ITEM_TTL)
     print(f"Item {i} put in queue")
 
 
-async def put_items(queue):
-    # Create a list of producer coroutines
-    producers = [produce_item(queue, i) for i in range(10)]
-    # Await their completion
-    await asyncio.gather(*producers)
-    # Put a sentinel value in the queue to indicate the producer is done
-    await queue.put(None)
+# stands in for parsing or computing on each item, holds the CPU the whole time
+def digest(i):
+    data = str(i).encode()
+    for _ in range(HASH_ROUNDS):
+        data = hashlib.sha256(data).digest()
+    return i, data.hex()[:8]
+
+
+async def digest_inline(i):
+    return digest(i)
 
 
-async def get_items(queue):
-    while True:
-        i = await queue.get()
-        if i is None:
-            # If we get the sentinel value, break out of the loop
-            break
-        print(f"Item {i} got from queue")
+async def get_item(result):
+    i, item_digest = result
+    print(f"Item {i} got from queue, digest {item_digest}")
 
 
 async def main():
-    queue = asyncio.Queue()
+    # consumers run as a pipeline stage, it finishes once every item is handled, no sentinel needed
+    queue = SchedulingQueue(
+        QUEUE_SIZE, on_expired=lambda i: print(f"Item {i} expired in queue")
+    )
+    if CPU_WORKERS == 0:
+        # blocks the event loop while it runs
+        digest_stage = Stage("digest", digest_inline, queue=queue)
+    else:
+        # off the event loop, in batches to a process per CPU
+        digest_stage = ProcessStage(
+            "digest", digest, concurrency=CPU_WORKERS, queue=queue, batch_size=4
+        )
+    pipeline = Pipeline(
+        digest_stage,
+        Stage("get_items", get_item, concurrency=CONSUMERS, maxsize=QUEUE_SIZE),
+    )
     # Run the producer and consumer tasks concurrently
-    await asyncio.gather(put_items(queue), get_items(queue))
+    await pipeline.run(produce_item(pipeline, i) for i in range(PRODUCERS))
+    pipeline.report()
 
 
 # Run the main coroutine
-t = time.perf_counter()
-asyncio.run(main())
-print(f"Time: {time.perf_counter() - t}")
+if __name__ == "__main__":
+    t = time.perf_counter()
+    runner.run(main())
+    print(f"Time: {time.perf_counter() - t}")
 
 # (venv) andrew@DESKTOP-M43FL6J:/mnt/nfs/Projects/Concurrency_and_Parallellism$ python3 ./src/async_queue.py
 # Item 0 put in queue
@@ -0,0 +1,198 @@
+import asyncio
+import os
+import websockets
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+from websockets.frames import Frame, Opcode
+
+# overflow policies, applied when a client's outbound queue is full
+DROP_OLDEST = "drop_oldest"  # discard the oldest queued message to make room
+DROP_NEWEST = "drop_newest"  # discard the message being broadcast
+DISCONNECT = "disconnect"  # close the connection of the slow client
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+# defaults, can be overridden through the environment
+BROADCAST_QUEUE_SIZE = int(os.getenv("BROADCAST_QUEUE_SIZE", "64"))
+BROADCAST_OVERFLOW = os.getenv("BROADCAST_OVERFLOW", DROP_OLDEST)
+
+
+def deflate_extensions():
+    """
+    Server extensions for websockets.serve().
+    Same settings as the websockets default, but without context takeover so a
+    compressed frame does not depend on the connection and can be shared.
+    """
+    return [
+        ServerPerMessageDeflateFactory(
+            server_no_context_takeover=True,
+            server_max_window_bits=12,
+            compress_settings={"memLevel": 5},
+        )
+    ]
+
+
+class PreparedMessage:
+    """
+    A message framed once and written as the same bytes to every connection.
+    The compressed frame is built lazily, once per negotiated deflate setting.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        if isinstance(message, str):
+            self.frame = Frame(Opcode.TEXT, message.encode())
+        else:
+            self.frame = Frame(Opcode.BINARY, bytes(message))
+        self.data = self.frame.serialize(mask=False)
+        self.compressed = {}
+
+    def data_for(self, websocket):
+        """
+        Return the serialized frame for a connection, or None if it has to be built per connection.
+        """
+        for extension in websocket.extensions:
+            if isinstance(extension, PerMessageDeflate):
+                # with context takeover the output depends on the connection history
+                if not extension.local_no_context_takeover:
+                    return None
+                key = (
+                    extension.local_max_window_bits,
+                    tuple(sorted(extension.compress_settings.items())),
+                )
+                if key not in self.compressed:
+                    # the compressor is reset for every message, so using the
+                    # connection's extension leaves its state untouched
+                    self.compressed[key] = self.frame.serialize(
+                        mask=False, extensions=[extension]
+                    )
+                return self.compressed[key]
+        return self.data
+
+
+async def send_prepared(websocket, prepared):
+    """
+    Write a prepared message to a connection, with the same flow control as websocket.send().
+    """
+    data = prepared.data_for(websocket)
+    if data is None:
+        await websocket.send(prepared.message)
+        return
+    await websocket.ensure_open()
+    websocket.transport.write(data)
+    await websocket.drain()
+
+
+class ClientWriter:
+    """
+    Bounded outbound queue and writer task for a single connection.
+    Messages are queued without touching the socket, so a slow client only delays itself.
+    """
+
+    def __init__(self, websocket, max_queue, overflow):
+        self.websocket = websocket
+        self.overflow = overflow
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.closing = None
+        self.task = asyncio.create_task(self.write())
+
+    def push(self, message):
+        """
+        Queue a message without blocking, applying the overflow policy when the queue is full.
+        """
+        if self.closing is not None:
+            return
+        if not self.queue.full():
+            self.queue.put_nowait(message)
+        elif self.overflow == DROP_OLDEST:
+            self.queue.get_nowait()
+            self.queue.put_nowait(message)
+            self.dropped += 1
+        elif self.overflow == DROP_NEWEST:
+            self.dropped += 1
+        else:
+            self.disconnect()
+
+    def disconnect(self):
+        """
+        Stop writing and close the connection, the handler cleans up once it is closed.
+        """
+        self.task.cancel()
+        self.closing = asyncio.create_task(
+            self.websocket.close(code=1013, reason="client too slow")
+        )
+
+    async def write(self):
+        """
+        Send queued messages to the client one at a time.
+        """
+        while True:
+            message = await self.queue.get()
+            try:
+                await send_prepared(self.websocket, message)
+            except websockets.ConnectionClosed:
+                break
+
+    def stop(self):
+        self.task.cancel()
+
+
+class Broadcaster:
+    """
+    Fan-out of messages to every connected client through per-client writers.
+    publish() never awaits a socket, so broadcast latency is set by each receiver, not the slowest one.
+    """
+
+    def __init__(self, max_queue=BROADCAST_QUEUE_SIZE, overflow=BROADCAST_OVERFLOW):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy: {overflow}, expected one of {OVERFLOW_POLICIES}"
+            )
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.clients = {}
+
+    def __len__(self):
+        return len(self.clients)
+
+    def add(self, websocket):
+        """
+        Start a writer for a newly connected client.
+        """
+        writer = ClientWriter(websocket, max_queue=self.max_queue, overflow=self.overflow)
+        self.clients[websocket] = writer
+        return writer
+
+    def remove(self, websocket):
+        """
+        Stop the writer of a disconnected client, pending messages are discarded.
+        """
+        writer = self.clients.pop(websocket, None)
+        if writer is not None:
+            writer.stop()
+
+    def send(self, websocket, message):
+        """
+        Queue a message for a single client.
+        """
+        if not isinstance(message, PreparedMessage):
+            message = PreparedMessage(message)
+        writer = self.clients.get(websocket)
+        if writer is not None:
+            writer.push(message)
+
+    def publish(self, message, targets=None):
+        """
+        Queue a message for every connected client, or only the given ones.
+        The frame is encoded once and shared.
+        """
+        prepared = PreparedMessage(message)
+        if targets is None:
+            writers = list(self.clients.values())
+        else:
+            writers = [self.clients[ws] for ws in targets if ws in self.clients]
+        # copied, a disconnect policy may remove clients while iterating
+        for writer in writers:
+            writer.push(prepared)
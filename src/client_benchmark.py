@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import statistics
+import time
+import tracemalloc
+
+# keep pygame's greeting off stdout, where --report-json output goes
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+import pygame
+import runner
+import game_protocol
+from multiplayer_pygame_client_rewrite import (
+    Game,
+    GAME_IN_QUEUE_SIZE,
+    GAME_OUT_QUEUE_SIZE,
+)
+from coalescing_queue import CoalescingQueue
+
+# id of the benchmarked client's own player, remote players are 1..n
+CONTROL_ID = 0
+# scripted input: hold each key for this many frames, then the next one
+KEY_HOLD_FRAMES = 30
+KEY_CYCLE = [pygame.K_d, pygame.K_s, pygame.K_a, pygame.K_w]
+
+
+class ScriptedInput:
+    """
+    Keys for each frame, cycling through d, s, a, w, and frame time and allocation samples.
+    Called once per frame by the game, at the same point of every frame.
+    """
+
+    def __init__(self):
+        self.frame_times = []
+        # peak bytes allocated during each frame above what was allocated at its start,
+        # only while tracemalloc is tracing
+        self.frame_peaks = []
+        self.last = None
+        self.frame_start = None
+
+    def __call__(self, frame):
+        now = time.perf_counter()
+        if self.last is not None:
+            self.frame_times.append(now - self.last)
+        self.last = now
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self.frame_start is not None:
+                self.frame_peaks.append(peak - self.frame_start)
+            tracemalloc.reset_peak()
+            self.frame_start = current
+
+        key = KEY_CYCLE[(frame // KEY_HOLD_FRAMES) % len(KEY_CYCLE)]
+        # a new mapping each frame, the game keeps it to replay unacknowledged inputs
+        return {k: k == key for k in KEY_CYCLE}
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+async def simulate_server(game_in_queue, players, tick_rate, binary, counts, own):
+    """
+    Send the game a new_connection, then a snapshot of every remote player moving each tick,
+    with the latest move received from the game, like the server folds them in.
+    """
+    await game_in_queue.put(
+        game_protocol.encode({"type": "new_connection", "id": CONTROL_ID}, binary)
+    )
+    tick = 0
+    while True:
+        tick += 1
+        snapshot = {
+            "type": "snapshot",
+            "tick": tick,
+            "players": [
+                {
+                    "id": id,
+                    "seq": 0,
+                    # players circle around the screen, each at its own phase
+                    "pos_x": 640 + 500 * math.cos(tick / 20 + id),
+                    "pos_y": 360 + 300 * math.sin(tick / 20 + id),
+                }
+                for id in range(1, players + 1)
+            ],
+            "removed": [],
+        }
+        if own:
+            snapshot["players"].append(dict(own, id=CONTROL_ID))
+        await game_in_queue.put(game_protocol.encode(snapshot, binary))
+        counts["in"] += 1
+        await asyncio.sleep(1 / tick_rate)
+
+
+async def drain(game_out_queue, counts, own):
+    """
+    Stand in for the websocket, count the messages the game sends and keep its latest move.
+    """
+    while True:
+        message = game_protocol.decode(await game_out_queue.get())
+        counts["out"] += 1
+        if message["type"] == "player_move":
+            own.update(
+                seq=message["seq"], pos_x=message["pos_x"], pos_y=message["pos_y"]
+            )
+
+
+async def benchmark(args):
+    if args.verbose:
+        # the per frame and per message events, sampled
+        logging.getLogger("game_client").setLevel(logging.DEBUG)
+    game_in_queue = asyncio.Queue(maxsize=GAME_IN_QUEUE_SIZE)
+    game_out_queue = CoalescingQueue(maxsize=GAME_OUT_QUEUE_SIZE)
+    scripted_input = ScriptedInput()
+    game = Game(
+        game_in_queue=game_in_queue,
+        game_out_queue=game_out_queue,
+        headless=True,
+        input_source=scripted_input,
+        fps=args.fps,
+        max_frames=args.frames,
+    )
+    game.binary = not args.json
+
+    counts = {"in": 0, "out": 0}
+    # latest move of the benchmarked client, echoed back in snapshots
+    own = {}
+    tasks = [
+        asyncio.create_task(game.process_in_queue()),
+        asyncio.create_task(
+            simulate_server(
+                game_in_queue, args.players, args.tick_rate, game.binary, counts, own
+            )
+        ),
+        asyncio.create_task(drain(game_out_queue, counts, own)),
+    ]
+    if args.trace_allocations:
+        tracemalloc.start()
+    start = time.perf_counter()
+    await game.async_run_game()
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+    for task in tasks:
+        task.cancel()
+    processed = counts["in"] - game_in_queue.qsize()
+
+    frame_ms = [t * 1000 for t in scripted_input.frame_times]
+    report = {
+        "players": args.players,
+        "binary": game.binary,
+        "frames": len(frame_ms),
+        "elapsed_sec": elapsed,
+        "frame_ms": {
+            "p50": percentile(frame_ms, 50),
+            "p95": percentile(frame_ms, 95),
+            "p99": percentile(frame_ms, 99),
+            "max": max(frame_ms),
+            "mean": statistics.mean(frame_ms),
+        },
+        "fps": len(frame_ms) / sum(frame_ms) * 1000,
+        "in_per_sec": processed / elapsed,
+        "out_per_sec": counts["out"] / elapsed,
+    }
+    if args.trace_allocations:
+        # includes what the event loop thread allocates during the frame
+        frame_kb = [b / 1024 for b in scripted_input.frame_peaks]
+        report["frame_peak_kb"] = {
+            "p50": percentile(frame_kb, 50),
+            "p99": percentile(frame_kb, 99),
+            "max": max(frame_kb),
+        }
+    if args.report_json:
+        print(json.dumps(report))
+        return
+    print(f"players: {args.players}, frames timed: {len(frame_ms)}, elapsed: {elapsed:.2f}s")
+    frame = report["frame_ms"]
+    print(
+        "frame time ms: "
+        f"p50 {frame['p50']:.3f}, "
+        f"p95 {frame['p95']:.3f}, "
+        f"p99 {frame['p99']:.3f}, "
+        f"max {frame['max']:.3f}, "
+        f"mean {frame['mean']:.3f}"
+    )
+    print(f"fps: {report['fps']:.1f}")
+    print(
+        f"messages/sec: in {report['in_per_sec']:.1f}, out {report['out_per_sec']:.1f}"
+    )
+    if args.trace_allocations:
+        peak = report["frame_peak_kb"]
+        print(
+            "peak KB allocated per frame: "
+            f"p50 {peak['p50']:.1f}, "
+            f"p99 {peak['p99']:.1f}, "
+            f"max {peak['max']:.1f}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Frame time benchmark of the headless game client with simulated players."
+    )
+    parser.add_argument("--players", type=int, default=100, help="remote players")
+    parser.add_argument("--frames", type=int, default=600, help="frames to run")
+    parser.add_argument("--fps", type=int, default=0, help="frame rate cap, 0 is uncapped")
+    parser.add_argument("--tick-rate", type=float, default=20, help="snapshots per second")
+    parser.add_argument("--json", action="store_true", help="JSON instead of the binary wire format")
+    parser.add_argument("--report-json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="log the per frame and per message events")
+    parser.add_argument(
+        "--trace-allocations",
+        action="store_true",
+        help="report the memory allocated per frame with tracemalloc, which slows the frames down",
+    )
+    runner.add_arguments(parser)
+    args = parser.parse_args()
+    if args.frames < 2:
+        parser.error("--frames must be at least 2, frame times are taken between frames")
+    runner.run(benchmark(args), args)
@@ -0,0 +1,63 @@
+import asyncio
+import collections
+
+
+class CoalescingQueue:
+    """
+    Bounded asyncio queue where a newer item replaces a queued item with the same key.
+    The replacement keeps its place in line and needs no free slot, so only the newest
+    state per key is ever sent and memory is bounded by the number of keys.
+    Items put without a key are queued like in asyncio.Queue.
+    """
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        # key -> item, in the order the keys were first queued
+        self.items = collections.OrderedDict()
+        # number of items dropped because a newer one replaced them
+        self.coalesced = 0
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+
+    def qsize(self):
+        return len(self.items)
+
+    def empty(self):
+        return not self.items
+
+    def full(self):
+        return 0 < self.maxsize <= len(self.items)
+
+    def put_nowait(self, item, key=None):
+        if key is not None and key in self.items:
+            self.items[key] = item
+            self.coalesced += 1
+            return
+        if self.full():
+            raise asyncio.QueueFull
+        # items without a key never coalesce
+        self.items[key if key is not None else object()] = item
+        self.not_empty.set()
+        if self.full():
+            self.not_full.clear()
+
+    async def put(self, item, key=None):
+        # wait for a free slot, unless the item replaces a queued one
+        while (key is None or key not in self.items) and self.full():
+            await self.not_full.wait()
+        self.put_nowait(item, key=key)
+
+    def get_nowait(self):
+        if not self.items:
+            raise asyncio.QueueEmpty
+        _, item = self.items.popitem(last=False)
+        if not self.items:
+            self.not_empty.clear()
+        self.not_full.set()
+        return item
+
+    async def get(self):
+        while not self.items:
+            await self.not_empty.wait()
+        return self.get_nowait()
@@ -0,0 +1,197 @@
+import threading
+import numpy as np
+
+# a player entry of a binary snapshot, same layout as game_protocol.SNAPSHOT_PLAYER_STRUCT
+PLAYER_DTYPE = np.dtype(
+    [("id", "<u4"), ("seq", "<u4"), ("pos_x", "<f4"), ("pos_y", "<f4")]
+)
+
+COLORS = {"red": (255, 0, 0)}
+
+
+def players_array(players):
+    """
+    Snapshot players as a PLAYER_DTYPE array.
+    Binary snapshot entries are viewed without copying, JSON entries are converted.
+    """
+    if isinstance(players, (bytes, bytearray, memoryview)):
+        return np.frombuffer(players, dtype=PLAYER_DTYPE)
+    return np.array(
+        [
+            (player["id"], player.get("seq", 0), player["pos_x"], player["pos_y"])
+            for player in players
+        ],
+        dtype=PLAYER_DTYPE,
+    )
+
+
+class EntityStore:
+    """
+    Struct of arrays holding every remote player, one row per player.
+    Updates, removals and the interpolated positions for drawing are a few array
+    operations per snapshot or frame, instead of work per Python object.
+    Rows are written on the event loop and read by the game thread, under lock.
+    """
+
+    def __init__(self, interpolation_delay, history=32, capacity=64):
+        self.interpolation_delay = interpolation_delay
+        self.history = history
+        self.count = 0
+        self.lock = threading.Lock()
+        # id -> row
+        self.index = {}
+        self.allocate(capacity)
+        self.reindex()
+
+    def allocate(self, capacity):
+        """
+        Grow the arrays to capacity rows, keeping the rows in use.
+        """
+        n = self.count
+        for name, shape, dtype, fill in (
+            ("ids", (capacity,), np.int64, 0),
+            ("pos", (capacity, 2), np.float64, 0),
+            ("colors", (capacity, 3), np.uint8, 0),
+            # received positions per row, oldest first, unused slots at time -inf
+            ("hist_time", (capacity, self.history), np.float64, -np.inf),
+            ("hist_pos", (capacity, self.history, 2), np.float64, 0),
+        ):
+            grown = np.full(shape, fill, dtype=dtype)
+            if n:
+                grown[:n] = getattr(self, name)[:n]
+            setattr(self, name, grown)
+
+    def reindex(self):
+        """
+        Sorted copy of the ids, to look up the rows of many ids at once.
+        """
+        order = np.argsort(self.ids[: self.count])
+        self.sorted_ids = self.ids[: self.count][order]
+        self.sorted_rows = order
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, id):
+        return id in self.index
+
+    def __iter__(self):
+        return iter(list(self.index))
+
+    def add(self, id, pos, color="red"):
+        with self.lock:
+            if id in self.index:
+                return
+            if self.count == len(self.ids):
+                self.allocate(2 * len(self.ids))
+            row = self.count
+            self.ids[row] = id
+            self.pos[row] = pos
+            self.colors[row] = COLORS.get(color, color)
+            self.hist_time[row] = -np.inf
+            self.index[id] = row
+            self.count += 1
+            self.reindex()
+
+    def pop(self, id, default=None):
+        """
+        Remove a player, the last row is moved into its place.
+        """
+        with self.lock:
+            row = self.index.pop(id, None)
+            if row is None:
+                return default
+            last = self.count - 1
+            if row != last:
+                for array in (
+                    self.ids,
+                    self.pos,
+                    self.colors,
+                    self.hist_time,
+                    self.hist_pos,
+                ):
+                    array[row] = array[last]
+                self.index[int(self.ids[row])] = row
+            self.count -= 1
+            self.reindex()
+            return id
+
+    def rows(self, ids):
+        """
+        Rows of the given ids, and which of them are in the store.
+        """
+        if self.count == 0:
+            return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+        found_at = np.minimum(np.searchsorted(self.sorted_ids, ids), self.count - 1)
+        found = self.sorted_ids[found_at] == ids
+        return self.sorted_rows[found_at], found
+
+    def shift_history(self, rows):
+        self.hist_time[rows, :-1] = self.hist_time[rows, 1:]
+        self.hist_pos[rows, :-1] = self.hist_pos[rows, 1:]
+
+    def update_positions(self, ids, pos, received, spawn_pos):
+        """
+        Record positions received at the same time for many players, adding unknown ones at spawn_pos.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        pos = np.asarray(pos, dtype=np.float64).reshape(-1, 2)
+        rows, found = self.rows(ids)
+        if not found.all():
+            # players joined before this client, first seen in a snapshot
+            for id in ids[~found]:
+                self.add(int(id), spawn_pos)
+            rows, found = self.rows(ids)
+
+        with self.lock:
+            last_time = self.hist_time[rows, -1]
+            # after standing still, start moving from the last position now
+            # rather than gliding there from when it was received
+            idle = rows[
+                np.isfinite(last_time)
+                & (received - last_time > self.interpolation_delay)
+            ]
+            if len(idle):
+                self.shift_history(idle)
+                self.hist_time[idle, -1] = received - self.interpolation_delay
+                self.hist_pos[idle, -1] = self.pos[idle]
+
+            self.shift_history(rows)
+            self.hist_time[rows, -1] = received
+            self.hist_pos[rows, -1] = pos
+            self.pos[rows] = pos
+
+    def positions_at(self, render_time):
+        """
+        Positions of every row interpolated between the received positions either side of render_time.
+        """
+        n = self.count
+        times = self.hist_time[:n]
+        # index of the first received position after render_time, history if none is
+        after = (times <= render_time).sum(axis=1)
+        end = np.clip(after, 1, self.history - 1)
+        start = end - 1
+        rows = np.arange(n)
+        start_time = times[rows, start]
+        end_time = times[rows, end]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fraction = (render_time - start_time) / (end_time - start_time)
+        # no earlier position to start from, use the later one
+        fraction = np.where(np.isfinite(start_time), fraction, 1.0)
+        fraction = np.clip(np.nan_to_num(fraction, nan=1.0), 0.0, 1.0)
+        start_pos = self.hist_pos[rows, start]
+        end_pos = self.hist_pos[rows, end]
+        positions = start_pos + (end_pos - start_pos) * fraction[:, None]
+        # past the latest position, or nothing received yet
+        latest = (after == self.history) | ~np.isfinite(times[:, -1])
+        positions[latest] = self.pos[:n][latest]
+        return positions
+
+    def draw_list(self, render_time):
+        """
+        (positions, colors) of every row as plain lists, ready to draw.
+        """
+        with self.lock:
+            positions = self.positions_at(render_time)
+            colors = self.colors[: self.count]
+            return positions.tolist(), colors.tolist()
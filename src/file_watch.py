@@ -0,0 +1,115 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+
+# seconds between checks when inotify is unavailable, and the longest wait when it is,
+# in case an event is missed (network filesystems do not report them)
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "1"))
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# appends, truncation, and the file being replaced, renamed or removed
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+)
+# wd, mask, cookie, length of the name that follows
+EVENT_STRUCT = struct.Struct("iIII")
+
+
+def load_libc():
+    name = ctypes.util.find_library("c")
+    if name is None:
+        return None
+    libc = ctypes.CDLL(name, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+class InotifyWatcher:
+    """
+    Wakes when a file changes, using inotify on its directory, so rotation and
+    recreation of the file are seen as well as appends.
+    """
+
+    def __init__(self, path, libc):
+        self.name = os.fsencode(os.path.basename(path))
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed on {directory}")
+        self.changed = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.fd, self.read_events)
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT_STRUCT.unpack_from(data, offset)
+            offset += EVENT_STRUCT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            # other files in the directory do not matter
+            if name == self.name:
+                self.changed.set()
+
+    async def wait(self):
+        try:
+            await asyncio.wait_for(self.changed.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        self.changed.clear()
+
+    def close(self):
+        self.loop.remove_reader(self.fd)
+        os.close(self.fd)
+
+
+class PollWatcher:
+    """
+    Fallback without inotify, checks every POLL_INTERVAL seconds.
+    """
+
+    async def wait(self):
+        await asyncio.sleep(POLL_INTERVAL)
+
+    def close(self):
+        pass
+
+
+def watch(path):
+    """
+    Watcher whose wait() returns once path may have changed, inotify when available.
+    """
+    libc = load_libc()
+    if libc is not None:
+        try:
+            return InotifyWatcher(path, libc)
+        except (OSError, NotImplementedError):
+            # out of inotify instances or watches, or a loop without add_reader
+            pass
+    return PollWatcher()
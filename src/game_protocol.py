@@ -0,0 +1,164 @@
+import json
+import math
+import struct
+
+# websocket subprotocols, negotiated at connect time
+# clients that offer neither get JSON
+BINARY = "game.binary.v3"
+JSON = "game.json"
+
+# binary message types, first byte of every binary frame
+NEW_CONNECTION = 1
+PLAYER_MOVE = 2
+SNAPSHOT = 3
+ACK = 4
+# same layout as SNAPSHOT, the client replaces its state with it
+FULL_SNAPSHOT = 5
+
+# fixed layouts, little-endian
+# 5 bytes: type, id
+NEW_CONNECTION_STRUCT = struct.Struct("<BI")
+# 17 bytes: type, id, seq, pos_x, pos_y
+PLAYER_MOVE_STRUCT = struct.Struct("<BIIff")
+# 5 bytes: type, tick
+ACK_STRUCT = struct.Struct("<BI")
+# 9 bytes: type, tick, number of players, number of removed ids
+SNAPSHOT_STRUCT = struct.Struct("<BIHH")
+# followed by the players, 16 bytes each: id, seq of the last move applied, pos_x, pos_y
+SNAPSHOT_PLAYER_STRUCT = struct.Struct("<IIff")
+# and the removed ids, 4 bytes each
+SNAPSHOT_REMOVED_STRUCT = struct.Struct("<I")
+# largest id, seq or tick a binary message can carry
+U32_MAX = 0xFFFFFFFF
+
+
+def subprotocols(binary=True):
+    """
+    Subprotocols to offer when connecting, in order of preference.
+    """
+    return [BINARY, JSON] if binary else [JSON]
+
+
+def is_binary(websocket):
+    return websocket.subprotocol == BINARY
+
+
+def valid_move(message):
+    """
+    True if a player_move received from a client can be applied: seq an integer in the
+    u32 range and finite positions. Anything else would fail to encode in every
+    snapshot the player appears in, so it is dropped on arrival.
+    """
+    seq = message.get("seq", 0)
+    if type(seq) is not int or not 0 <= seq <= U32_MAX:
+        return False
+    for pos in (message.get("pos_x"), message.get("pos_y")):
+        if type(pos) is float:
+            if not math.isfinite(pos):
+                return False
+        # bool is an int subclass, and not a position
+        elif type(pos) is not int:
+            return False
+    return True
+
+
+def coalesce_key(message):
+    """
+    Messages with the same key supersede each other, only the newest needs to be sent.
+    """
+    message_type = message.get("type")
+    if message_type == "player_move":
+        return ("player_move", message.get("id"))
+    if message_type == "ack":
+        return ("ack",)
+    return None
+
+
+def encode(message, binary):
+    """
+    Encode a message dict, as bytes for the hot message types when binary is negotiated, else as JSON.
+    """
+    if binary:
+        message_type = message.get("type")
+        if message_type == "player_move":
+            return PLAYER_MOVE_STRUCT.pack(
+                PLAYER_MOVE,
+                message["id"],
+                message["seq"],
+                message["pos_x"],
+                message["pos_y"],
+            )
+        if message_type == "snapshot":
+            players = message["players"]
+            removed = message["removed"]
+            snapshot_type = FULL_SNAPSHOT if message.get("full") else SNAPSHOT
+            parts = [
+                SNAPSHOT_STRUCT.pack(snapshot_type, message["tick"], len(players), len(removed))
+            ]
+            parts.extend(
+                SNAPSHOT_PLAYER_STRUCT.pack(
+                    player["id"], player["seq"], player["pos_x"], player["pos_y"]
+                )
+                for player in players
+            )
+            parts.extend(SNAPSHOT_REMOVED_STRUCT.pack(id) for id in removed)
+            return b"".join(parts)
+        if message_type == "ack":
+            return ACK_STRUCT.pack(ACK, message["tick"])
+        if message_type == "new_connection":
+            return NEW_CONNECTION_STRUCT.pack(NEW_CONNECTION, message["id"])
+    # any other message type stays JSON, sent as a text frame
+    return json.dumps(message)
+
+
+def decode(data, raw_players=False):
+    """
+    Decode a received frame, text frames are JSON and binary frames use the fixed layouts.
+    With raw_players, the players of a binary snapshot are left as a view of their
+    SNAPSHOT_PLAYER_STRUCT records, for readers that load them into arrays.
+    """
+    if isinstance(data, str):
+        return json.loads(data)
+    message_type = data[0]
+    if message_type == PLAYER_MOVE:
+        _, id, seq, pos_x, pos_y = PLAYER_MOVE_STRUCT.unpack(data)
+        return {
+            "type": "player_move",
+            "id": id,
+            "seq": seq,
+            "pos_x": pos_x,
+            "pos_y": pos_y,
+        }
+    if message_type in (SNAPSHOT, FULL_SNAPSHOT):
+        _, tick, n_players, n_removed = SNAPSHOT_STRUCT.unpack_from(data)
+        offset = SNAPSHOT_STRUCT.size
+        end = offset + n_players * SNAPSHOT_PLAYER_STRUCT.size
+        if raw_players:
+            players = memoryview(data)[offset:end]
+        else:
+            players = [
+                {"id": id, "seq": seq, "pos_x": pos_x, "pos_y": pos_y}
+                for id, seq, pos_x, pos_y in SNAPSHOT_PLAYER_STRUCT.iter_unpack(
+                    data[offset:end]
+                )
+            ]
+        removed = [
+            id
+            for (id,) in SNAPSHOT_REMOVED_STRUCT.iter_unpack(
+                data[end : end + n_removed * SNAPSHOT_REMOVED_STRUCT.size]
+            )
+        ]
+        return {
+            "type": "snapshot",
+            "tick": tick,
+            "players": players,
+            "removed": removed,
+            "full": message_type == FULL_SNAPSHOT,
+        }
+    if message_type == ACK:
+        _, tick = ACK_STRUCT.unpack(data)
+        return {"type": "ack", "tick": tick}
+    if message_type == NEW_CONNECTION:
+        _, id = NEW_CONNECTION_STRUCT.unpack(data)
+        return {"type": "new_connection", "id": id}
+    raise ValueError(f"Unknown binary message type: {message_type}")
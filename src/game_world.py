@@ -0,0 +1,301 @@
+import collections
+import math
+
+# players are kept inside the 1280x720 screen, and spawn at its centre
+WORLD_WIDTH = 1280
+WORLD_HEIGHT = 720
+SPAWN_POS = (WORLD_WIDTH / 2, WORLD_HEIGHT / 2)
+
+# ids are a slot in the low bits and the slot's generation in the high bits,
+# fitting the 32 bit ids of the binary protocol
+SLOT_BITS = 20
+SLOT_MASK = (1 << SLOT_BITS) - 1
+GENERATION_MASK = (1 << (32 - SLOT_BITS)) - 1
+
+
+class IdAllocator:
+    """
+    Constant time allocation of player ids.
+    A released slot is reused with its generation bumped, so the new player gets a
+    different id and messages meant for the previous owner can be told apart.
+    """
+
+    def __init__(self):
+        # slot -> current generation
+        self.generations = []
+        # released slots, reused oldest first
+        self.free = collections.deque()
+
+    def allocate(self):
+        if self.free:
+            slot = self.free.popleft()
+        else:
+            slot = len(self.generations)
+            self.generations.append(0)
+        return (self.generations[slot] << SLOT_BITS) | slot
+
+    def release(self, id):
+        slot = id & SLOT_MASK
+        self.generations[slot] = (self.generations[slot] + 1) & GENERATION_MASK
+        self.free.append(slot)
+
+
+class Grid:
+    """
+    Uniform grid spatial index.
+    With cells as large as the query radius, a query only looks at the 3x3 cells around the centre.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        # (cell_x, cell_y) -> ids in the cell
+        self.cells = {}
+        # id -> (cell, pos_x, pos_y)
+        self.entries = {}
+
+    def cell(self, pos_x, pos_y):
+        return (int(pos_x // self.cell_size), int(pos_y // self.cell_size))
+
+    def move(self, id, pos_x, pos_y):
+        cell = self.cell(pos_x, pos_y)
+        entry = self.entries.get(id)
+        if entry is not None and entry[0] != cell:
+            self.discard(id, entry[0])
+        if entry is None or entry[0] != cell:
+            self.cells.setdefault(cell, set()).add(id)
+        self.entries[id] = (cell, pos_x, pos_y)
+
+    def remove(self, id):
+        entry = self.entries.pop(id, None)
+        if entry is not None:
+            self.discard(id, entry[0])
+
+    def discard(self, id, cell):
+        ids = self.cells[cell]
+        ids.discard(id)
+        if not ids:
+            del self.cells[cell]
+
+    def query(self, pos_x, pos_y, radius):
+        """
+        Return the ids within radius of a position.
+        """
+        # cells that can hold a point within radius, 1 when cells are as large as the radius
+        reach = math.ceil(radius / self.cell_size)
+        cell_x, cell_y = self.cell(pos_x, pos_y)
+        radius_sq = radius * radius
+        found = set()
+        for x in range(cell_x - reach, cell_x + reach + 1):
+            for y in range(cell_y - reach, cell_y + reach + 1):
+                for id in self.cells.get((x, y), ()):
+                    _, other_x, other_y = self.entries[id]
+                    if (other_x - pos_x) ** 2 + (other_y - pos_y) ** 2 <= radius_sq:
+                        found.add(id)
+        return found
+
+
+class World:
+    """
+    Authoritative game state held by the server.
+    Player moves are folded into a table of latest positions. Each client is sent
+    only the players that changed since the last snapshot it acknowledged, and with
+    an area of interest radius only the players around its own.
+    A client that leaves a snapshot unacknowledged for max_ack_lag ticks is sent full
+    snapshots until it acknowledges one, so removals are only kept for that long.
+    Idle clients are sent nothing, so they have nothing to acknowledge and never fall behind.
+    """
+
+    def __init__(self, aoi_radius=None, max_ack_lag=100):
+        # last tick closed, changes made since then belong to tick + 1
+        self.tick = 0
+        # id -> (pos_x, pos_y), only the latest position of each player is kept
+        self.positions = {}
+        # id -> sequence number of the last move applied, clients reconcile against it
+        self.seqs = {}
+        # id -> tick of the last change / of the removal
+        self.changed = {}
+        self.removed = {}
+        # client id -> last tick acknowledged by the client
+        self.acked = {}
+        # client id -> ticks of the snapshots sent to it and not acknowledged yet, oldest first
+        self.pending = {}
+        self.max_ack_lag = max_ack_lag
+
+        # area of interest, None sends every player to every client
+        self.aoi_radius = aoi_radius
+        if aoi_radius is not None:
+            self.grid = Grid(cell_size=aoi_radius)
+            # client id -> {id: tick it came into view}, {id: tick it went out of view}
+            self.visible = {}
+            self.hidden = {}
+
+    def join(self, id):
+        # nothing acknowledged yet, the first delta holds the full state
+        self.acked[id] = 0
+        self.pending[id] = collections.deque()
+        self.removed.pop(id, None)
+        if self.aoi_radius is not None:
+            self.visible[id] = {}
+            self.hidden[id] = {}
+        self.move(id, *SPAWN_POS)
+
+    def leave(self, id):
+        self.acked.pop(id, None)
+        self.pending.pop(id, None)
+        if self.aoi_radius is not None:
+            # the client may have failed before joining
+            self.visible.pop(id, None)
+            self.hidden.pop(id, None)
+            self.grid.remove(id)
+        if self.positions.pop(id, None) is not None:
+            self.seqs.pop(id)
+            self.changed.pop(id)
+            self.removed[id] = self.tick + 1
+
+    def move(self, id, pos_x, pos_y, seq=0):
+        # the server has the final say on positions, players stay inside the world
+        pos_x = min(max(pos_x, 0), WORLD_WIDTH)
+        pos_y = min(max(pos_y, 0), WORLD_HEIGHT)
+        # an idle player is not marked as changed and costs nothing to send,
+        # a new seq is sent so the client can drop the inputs it covers
+        if self.positions.get(id) != (pos_x, pos_y) or self.seqs.get(id) != seq:
+            self.positions[id] = (pos_x, pos_y)
+            self.seqs[id] = seq
+            self.changed[id] = self.tick + 1
+            if self.aoi_radius is not None:
+                self.grid.move(id, pos_x, pos_y)
+
+    def ack(self, id, tick):
+        # acks can arrive out of order, only move forward
+        if id in self.acked and self.acked[id] < tick <= self.tick:
+            self.acked[id] = tick
+            pending = self.pending[id]
+            while pending and pending[0] <= tick:
+                pending.popleft()
+
+    def advance(self):
+        """
+        Close the current tick.
+        """
+        self.tick += 1
+        return self.tick
+
+    def sent(self, id):
+        """
+        Record that the client was sent a snapshot this tick.
+        """
+        # while behind only the oldest unacknowledged snapshot matters, this stays bounded
+        if not self.behind(id):
+            self.pending[id].append(self.tick)
+
+    def behind(self, id):
+        """
+        True if a snapshot sent to the client went unacknowledged for more than max_ack_lag ticks.
+        """
+        pending = self.pending[id]
+        return bool(pending) and pending[0] < self.tick - self.max_ack_lag
+
+    def view_key(self, id):
+        """
+        Clients with equal keys are sent the same delta this tick.
+        """
+        if self.aoi_radius is None:
+            return "full" if self.behind(id) else self.acked[id]
+        # every client has its own view
+        return ("client", id)
+
+    def delta_for(self, id):
+        """
+        Snapshot to send to a client this tick, None if there is nothing new for it.
+        Call once per client and tick, it records what came into and out of view.
+        """
+        if self.aoi_radius is None:
+            if self.behind(id):
+                return self.full()
+            return self.delta(self.acked[id])
+
+        in_view = self.grid.query(*self.positions[id], self.aoi_radius)
+        if self.behind(id):
+            # start over from what is in view now
+            self.visible[id] = dict.fromkeys(in_view, self.tick)
+            self.hidden[id] = {}
+            return self.full(in_view)
+
+        acked = self.acked[id]
+        visible = self.visible[id]
+        hidden = self.hidden[id]
+
+        players = []
+        for other in in_view:
+            entered = visible.get(other)
+            if entered is None:
+                # came into view, sent in full whether or not it moved
+                visible[other] = entered = self.tick
+                hidden.pop(other, None)
+            # resent until the client acknowledges it came into view
+            if entered > acked or self.changed[other] > acked:
+                players.append(self.entry(other))
+
+        # went out of view or disconnected, the client drops it
+        for other in [other for other in visible if other not in in_view]:
+            visible.pop(other)
+            hidden[other] = self.tick
+        removed = []
+        for other, tick in list(hidden.items()):
+            if tick > acked:
+                removed.append(other)
+            else:
+                hidden.pop(other)
+
+        if not players and not removed:
+            return None
+        return {
+            "type": "snapshot",
+            "tick": self.tick,
+            "players": players,
+            "removed": removed,
+        }
+
+    def entry(self, id):
+        pos_x, pos_y = self.positions[id]
+        return {"id": id, "seq": self.seqs[id], "pos_x": pos_x, "pos_y": pos_y}
+
+    def full(self, ids=None):
+        """
+        Snapshot of every player, or of the given ones, the client drops any player not in it.
+        """
+        return {
+            "type": "snapshot",
+            "tick": self.tick,
+            "players": [self.entry(id) for id in (self.positions if ids is None else ids)],
+            "removed": [],
+            "full": True,
+        }
+
+    def delta(self, acked):
+        """
+        Snapshot of the players changed or removed since the acknowledged tick, None if nothing did.
+        """
+        players = [
+            self.entry(id) for id, tick in self.changed.items() if tick > acked
+        ]
+        removed = [id for id, tick in self.removed.items() if tick > acked]
+        if not players and not removed:
+            return None
+        return {
+            "type": "snapshot",
+            "tick": self.tick,
+            "players": players,
+            "removed": removed,
+        }
+
+    def prune(self):
+        """
+        Forget removals every client has acknowledged, or that are older than max_ack_lag
+        ticks. A client that has not acknowledged such a removal was sent it more than
+        max_ack_lag ticks ago, so it is behind and is sent full snapshots instead.
+        """
+        oldest = max(min(self.acked.values(), default=self.tick), self.tick - self.max_ack_lag)
+        for id, tick in list(self.removed.items()):
+            if tick <= oldest:
+                self.removed.pop(id)
@@ -0,0 +1,430 @@
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import time
+import websockets
+import game_protocol
+import runner
+from game_world import WORLD_HEIGHT, WORLD_WIDTH
+
+# server scripts, to find their processes when no pid is given
+SERVER_SCRIPTS = {
+    "chat": "websocket_server.py",
+    "game": "multiplayer_pygame_server.py",
+}
+
+# histogram buckets per doubling of latency, about 3% wide
+BUCKETS_PER_DOUBLING = 24
+
+
+class Histogram:
+    """
+    Latencies counted in log-spaced buckets, bounded in memory however many are recorded
+    and merged across processes by adding counts.
+    """
+
+    def __init__(self, counts=None):
+        # bucket -> count
+        self.counts = counts or {}
+
+    def record(self, seconds):
+        micros = max(seconds * 1e6, 1.0)
+        bucket = int(math.log2(micros) * BUCKETS_PER_DOUBLING)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def percentile(self, p):
+        """
+        Upper bound of the bucket holding the p-th percentile, in milliseconds.
+        """
+        total = len(self)
+        if not total:
+            return float("nan")
+        rank = math.ceil(total * p / 100)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return 2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING) / 1000
+        return float("nan")
+
+
+class Stats:
+    """
+    What one worker process measured, only counted once the measurement window opened.
+    """
+
+    def __init__(self):
+        self.connected = 0
+        self.connect_failed = 0
+        self.disconnected = 0
+        self.sent = 0
+        self.received = 0
+        self.bytes_received = 0
+        self.connect_latency = Histogram()
+        self.latency = Histogram()
+        # exception -> count, from receive tasks that died of something other than the connection closing
+        self.receive_errors = {}
+
+    def to_dict(self):
+        data = dict(vars(self))
+        data["connect_latency"] = self.connect_latency.counts
+        data["latency"] = self.latency.counts
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        vars(stats).update(data)
+        stats.connect_latency = Histogram(data["connect_latency"])
+        stats.latency = Histogram(data["latency"])
+        return stats
+
+    def merge(self, other):
+        for name in (
+            "connected",
+            "connect_failed",
+            "disconnected",
+            "sent",
+            "received",
+            "bytes_received",
+        ):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.connect_latency.merge(other.connect_latency)
+        self.latency.merge(other.latency)
+        for error, count in other.receive_errors.items():
+            self.receive_errors[error] = self.receive_errors.get(error, 0) + count
+
+
+async def chat_client(websocket, args, number, stats, window):
+    """
+    Send chat messages stamped with sent_at, and time every message fanned out back to this client.
+    """
+    name = f"load-{os.getpid()}-{number}"
+    payload = "x" * args.payload
+
+    async def receive():
+        async for message in websocket:
+            now = time.time()
+            if now < window[0]:
+                continue
+            stats.received += 1
+            stats.bytes_received += len(message)
+            sent_at = json.loads(message).get("sent_at")
+            if sent_at is not None:
+                stats.latency.record(now - sent_at)
+
+    receiver = asyncio.create_task(receive())
+    try:
+        await websocket.send(json.dumps({"type": "join", "room": "lobby", "name": name}))
+        async for _ in ticker(args.message_rate, window[1]):
+            await websocket.send(
+                json.dumps({"name": name, "message_text": payload, "sent_at": time.time()})
+            )
+            if time.time() >= window[0]:
+                stats.sent += 1
+    finally:
+        await stop_receiver(receiver, stats)
+
+
+async def game_client(websocket, args, number, stats, window):
+    """
+    Random walk with player_move messages, timed until the server echoes their seq back in a snapshot.
+    """
+    binary = game_protocol.is_binary(websocket)
+    message = game_protocol.decode(await websocket.recv())
+    id = message["id"]
+    pos_x, pos_y = random.uniform(0, WORLD_WIDTH), random.uniform(0, WORLD_HEIGHT)
+    # seq -> time sent, until a snapshot shows the server applied it
+    in_flight = {}
+
+    async def receive():
+        async for data in websocket:
+            now = time.time()
+            message = game_protocol.decode(data, raw_players=True)
+            if message["type"] != "snapshot":
+                continue
+            await websocket.send(
+                game_protocol.encode({"type": "ack", "tick": message["tick"]}, binary)
+            )
+            if now < window[0]:
+                continue
+            stats.received += 1
+            stats.bytes_received += len(data)
+            players = message["players"]
+            if binary:
+                players = (
+                    {"id": player[0], "seq": player[1]}
+                    for player in game_protocol.SNAPSHOT_PLAYER_STRUCT.iter_unpack(players)
+                )
+            for player in players:
+                if player["id"] == id:
+                    seq = player["seq"]
+                    sent_at = in_flight.pop(seq, None)
+                    if sent_at is not None:
+                        stats.latency.record(now - sent_at)
+                    # older moves were superseded by this one
+                    for old in [old for old in in_flight if old < seq]:
+                        del in_flight[old]
+                    break
+
+    receiver = asyncio.create_task(receive())
+    try:
+        seq = 0
+        async for _ in ticker(args.message_rate, window[1]):
+            seq += 1
+            pos_x = min(max(pos_x + random.uniform(-10, 10), 0), WORLD_WIDTH)
+            pos_y = min(max(pos_y + random.uniform(-10, 10), 0), WORLD_HEIGHT)
+            in_flight[seq] = time.time()
+            await websocket.send(
+                game_protocol.encode(
+                    {
+                        "type": "player_move",
+                        "id": id,
+                        "seq": seq,
+                        "pos_x": pos_x,
+                        "pos_y": pos_y,
+                    },
+                    binary,
+                )
+            )
+            if time.time() >= window[0]:
+                stats.sent += 1
+    finally:
+        await stop_receiver(receiver, stats)
+
+
+async def stop_receiver(receiver, stats):
+    """
+    Cancel a client's receive task and count the exception it died of, if it did not
+    just end with the connection, so a broken receiver shows up in the report.
+    """
+    receiver.cancel()
+    try:
+        await receiver
+    except (asyncio.CancelledError, websockets.ConnectionClosed):
+        pass
+    except Exception as error:
+        key = f"{type(error).__name__}: {error}"
+        stats.receive_errors[key] = stats.receive_errors.get(key, 0) + 1
+
+
+async def ticker(rate, end):
+    """
+    Yield rate times a second until end, starting at a random phase so clients do not send in lockstep.
+    """
+    interval = 1 / rate
+    next_time = time.time() + random.uniform(0, interval)
+    while next_time < end:
+        await asyncio.sleep(max(next_time - time.time(), 0))
+        yield
+        next_time += interval
+
+
+async def run_client(args, number, start_at, stats, window):
+    await asyncio.sleep(max(start_at - time.time(), 0))
+    connect_start = time.time()
+    try:
+        websocket = await websockets.connect(
+            args.url,
+            subprotocols=game_protocol.subprotocols(binary=not args.json)
+            if args.protocol == "game"
+            else None,
+            max_queue=None,
+            open_timeout=30,
+        )
+    except Exception:
+        stats.connect_failed += 1
+        return
+    stats.connected += 1
+    stats.connect_latency.record(time.time() - connect_start)
+    client = chat_client if args.protocol == "chat" else game_client
+    try:
+        await client(websocket, args, number, stats, window)
+    except websockets.ConnectionClosed:
+        stats.disconnected += 1
+    finally:
+        await websocket.close()
+
+
+async def worker_main(args, worker, start, results):
+    stats = Stats()
+    # measurement window, opens once every client had time to connect
+    ramp = args.clients / args.connect_rate
+    window = (start + ramp + args.warmup, start + ramp + args.warmup + args.duration)
+    # this worker's clients, every args.workers-th connect slot
+    numbers = range(worker, args.clients, args.workers)
+    await asyncio.gather(
+        *(
+            run_client(args, number, start + number / args.connect_rate, stats, window)
+            for number in numbers
+        )
+    )
+    results.put(stats.to_dict())
+
+
+def run_worker(args, worker, start, results):
+    # one socket per client, lift the open file limit as far as allowed
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    runner.run(worker_main(args, worker, start, results), args)
+
+
+def server_pids(args):
+    if args.server_pid:
+        return args.server_pid
+    script = SERVER_SCRIPTS[args.protocol]
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as file:
+                cmdline = file.read().split(b"\0")
+        except OSError:
+            continue
+        if any(os.path.basename(part.decode(errors="replace")) == script for part in cmdline):
+            pids.append(int(entry))
+    return pids
+
+
+def rss_kb(pids):
+    """
+    Resident set size of the processes summed, from /proc/<pid>/status.
+    """
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as file:
+                for line in file:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total
+
+
+def main(args):
+    pids = server_pids(args)
+    start = time.time() + 1
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(args, worker, start, results))
+        for worker in range(args.workers)
+    ]
+    for process in workers:
+        process.start()
+
+    # sample the server while the load runs
+    rss = [rss_kb(pids)]
+    end = start + args.clients / args.connect_rate + args.warmup + args.duration
+    while time.time() < end:
+        time.sleep(1)
+        rss.append(rss_kb(pids))
+
+    # a worker that died before putting its results never will, poll instead of blocking on get
+    stats = Stats()
+    collected = 0
+    failed = []
+    while collected + len(failed) < len(workers):
+        try:
+            stats.merge(Stats.from_dict(results.get(timeout=1)))
+            collected += 1
+        except queue.Empty:
+            failed = [process for process in workers if process.exitcode not in (None, 0)]
+    for process in workers:
+        process.join()
+
+    report = {
+        "protocol": args.protocol,
+        "clients": args.clients,
+        "connected": stats.connected,
+        "connect_failed": stats.connect_failed,
+        "disconnected": stats.disconnected,
+        "connect_ms": {
+            "p50": stats.connect_latency.percentile(50),
+            "p99": stats.connect_latency.percentile(99),
+        },
+        "sent_per_sec": stats.sent / args.duration,
+        "received_per_sec": stats.received / args.duration,
+        "received_mb_per_sec": stats.bytes_received / args.duration / 1e6,
+        "latency_ms": {
+            "p50": stats.latency.percentile(50),
+            "p99": stats.latency.percentile(99),
+            "p999": stats.latency.percentile(99.9),
+            "samples": len(stats.latency),
+        },
+        "receive_errors": stats.receive_errors,
+        "workers_failed": {process.pid: process.exitcode for process in failed},
+        "server_pids": pids,
+        "server_rss_mb": {
+            "start": rss[0] / 1024,
+            "peak": max(rss) / 1024,
+            "end": rss[-1] / 1024,
+        },
+    }
+    if args.report_json:
+        print(json.dumps(report))
+        return
+    print(
+        f"{args.protocol}: {stats.connected}/{args.clients} connected, "
+        f"{stats.connect_failed} failed, {stats.disconnected} disconnected"
+    )
+    print(
+        f"connect ms: p50 {report['connect_ms']['p50']:.2f}, p99 {report['connect_ms']['p99']:.2f}"
+    )
+    print(
+        f"messages/sec: sent {report['sent_per_sec']:.1f}, "
+        f"received {report['received_per_sec']:.1f} "
+        f"({report['received_mb_per_sec']:.2f} MB/s)"
+    )
+    latency = report["latency_ms"]
+    print(
+        f"latency ms: p50 {latency['p50']:.2f}, p99 {latency['p99']:.2f}, "
+        f"p999 {latency['p999']:.2f} ({latency['samples']} samples)"
+    )
+    for error, count in stats.receive_errors.items():
+        print(f"receive error x{count}: {error}")
+    if failed:
+        exits = ", ".join(f"pid {process.pid} exit {process.exitcode}" for process in failed)
+        print(f"workers failed, their clients are missing from the results: {exits}")
+    if pids:
+        server_rss = report["server_rss_mb"]
+        print(
+            f"server rss MB: start {server_rss['start']:.1f}, "
+            f"peak {server_rss['peak']:.1f}, end {server_rss['end']:.1f}"
+        )
+    else:
+        print("server rss: server process not found, pass --server-pid")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Swarm of websocket clients against the chat or game server on localhost."
+    )
+    parser.add_argument("protocol", choices=sorted(SERVER_SCRIPTS), help="server to load")
+    parser.add_argument("--url", default="ws://localhost:8765")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="client processes")
+    parser.add_argument("--connect-rate", type=float, default=500, help="connections per second")
+    parser.add_argument("--message-rate", type=float, default=1, help="messages per second per client")
+    parser.add_argument("--payload", type=int, default=32, help="chat message_text bytes")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds after connecting before measuring")
+    parser.add_argument("--duration", type=float, default=10, help="seconds measured")
+    parser.add_argument("--json", action="store_true", help="game: JSON instead of the binary wire format")
+    parser.add_argument("--server-pid", type=int, action="append", help="server process to sample, repeatable")
+    parser.add_argument("--report-json", action="store_true", help="print the report as JSON")
+    runner.add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,173 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import multiprocessing.util
+import os
+import queue
+
+# lowest level written, DEBUG turns on the per frame and per message events
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# hot path events are written once every LOG_SAMPLE times they happen
+LOG_SAMPLE = int(os.getenv("LOG_SAMPLE", "100"))
+# text or json, one record per line
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# records waiting for the writer thread, more than this are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+handler = None
+
+
+class TextFormatter(logging.Formatter):
+    """
+    event followed by its fields as key=value.
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def formatMessage(self, record):
+        # before any traceback, which format() appends
+        line = super().formatMessage(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value!r}" for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=repr)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without formatting them or ever blocking,
+    records are dropped when the writer falls behind.
+    The writer thread is started by the first record each process logs, so a forked
+    child, such as a server worker, gets its own instead of the parent's dead one.
+    """
+
+    def __init__(self, target):
+        super().__init__(queue.Queue(LOG_QUEUE_SIZE))
+        self.target = target
+        self.listener = None
+        # QueueListener.stop cannot be called twice
+        self.running = False
+        self.dropped = 0
+
+    def start(self):
+        self.listener = logging.handlers.QueueListener(self.queue, self.target)
+        self.listener.start()
+        self.running = True
+        # multiprocessing children leave through os._exit, which skips atexit
+        multiprocessing.util.Finalize(None, self.stop, exitpriority=0)
+
+    def stop(self):
+        """
+        Write what is queued and stop the writer thread.
+        """
+        if self.running:
+            self.running = False
+            self.listener.stop()
+
+    def after_fork(self):
+        # the parent's writer thread does not exist in the child, and the queue's
+        # lock may have been held by it at the time of the fork
+        self.queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.listener = None
+        self.running = False
+
+    def prepare(self, record):
+        # formatting happens in the writer thread
+        return record
+
+    def enqueue(self, record):
+        # called under the handler's lock, only one thread starts the writer
+        if self.listener is None:
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup():
+    """
+    Send every record through a bounded queue to a thread that formats and writes them
+    to stderr, so logging never waits on I/O. Safe to call more than once.
+    """
+    global handler
+    if handler is not None:
+        return
+    stream = logging.StreamHandler()
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    handler = DroppingQueueHandler(stream)
+    logging.getLogger().addHandler(handler)
+    # write what is queued before exiting
+    atexit.register(handler.stop)
+    os.register_at_fork(after_in_child=handler.after_fork)
+
+
+class Log:
+    """
+    Structured logger, events are a short name plus keyword fields.
+    Fields are only formatted by the writer thread, and nothing is built when the
+    level is disabled, so callers pass values rather than formatted strings.
+    """
+
+    def __init__(self, name):
+        setup()
+        self.logger = logging.getLogger(name)
+        # only this repo's loggers, libraries keep their default of warnings and up
+        self.logger.setLevel(LOG_LEVEL)
+        # event -> number of times seen, for sampling
+        self.counts = {}
+
+    def enabled(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, event, fields, exc_info=None):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        self.log(logging.ERROR, event, fields, exc_info=True)
+
+    def sample(self, event, level=logging.DEBUG, every=None, **fields):
+        """
+        Log one in every `every` (LOG_SAMPLE by default) occurrences of a hot path event.
+        """
+        if not self.logger.isEnabledFor(level):
+            return
+        every = every or LOG_SAMPLE
+        count = self.counts.get(event, 0)
+        self.counts[event] = count + 1
+        if count % every == 0:
+            fields["count"] = count + 1
+            self.logger.log(level, event, extra={"fields": fields})
+
+
+def get_logger(name):
+    return Log(name)
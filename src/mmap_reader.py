@@ -0,0 +1,199 @@
+import argparse
+import array
+import mmap
+import os
+import struct
+
+# magic, inode of the indexed file, bytes of it indexed, number of lines,
+# and the last FINGERPRINT_SIZE bytes indexed
+INDEX_HEADER = struct.Struct("<8sQQQ32s")
+INDEX_MAGIC = b"LINEIDX2"
+# a file rewritten in place keeps its inode, these bytes tell it apart
+FINGERPRINT_SIZE = 32
+
+
+class MmapReader:
+    """
+    Random access to the lines of an append-only file, like data/example.txt.
+    The file is memory-mapped and a line-offset index is kept next to it in
+    <path>.idx. Opening again only indexes what was appended since, so line(n)
+    and tail(k) cost O(1) and O(k) however large the file is.
+    Lines are returned as memoryviews of the mapping, without their newline and
+    without copying. A trailing line without a newline yet is left out.
+    """
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or path + ".idx"
+        self.file = open(path, "rb")
+        self.mm = None
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        # offset where each line starts
+        self.starts = array.array("Q")
+        # bytes covered by the index, the end of the last complete line
+        self.indexed = 0
+        self.fingerprint = b""
+        self.load_index()
+        self.refresh()
+
+    def load_index(self):
+        try:
+            with open(self.index_path, "rb") as file:
+                header = file.read(INDEX_HEADER.size)
+                if len(header) < INDEX_HEADER.size:
+                    return
+                magic, inode, indexed, count, fingerprint = INDEX_HEADER.unpack(header)
+                size = os.fstat(self.file.fileno()).st_size
+                if magic != INDEX_MAGIC or inode != self.inode or indexed > size:
+                    # another or a truncated file, index from scratch
+                    return
+                starts = array.array("Q")
+                starts.frombytes(file.read(count * starts.itemsize))
+                if len(starts) != count:
+                    return
+        except FileNotFoundError:
+            return
+        self.starts = starts
+        self.indexed = indexed
+        # checked against the file by refresh
+        self.fingerprint = fingerprint
+
+    def last_bytes(self):
+        start = max(self.indexed - FINGERPRINT_SIZE, 0)
+        return bytes(self.mm[start : self.indexed]).ljust(FINGERPRINT_SIZE, b"\0")
+
+    def save_index(self, new_lines):
+        """
+        Append the new offsets and then update the header, a crash in between leaves
+        extra offsets past the count, which the next save overwrites.
+        """
+        count = len(self.starts)
+        header = INDEX_HEADER.pack(
+            INDEX_MAGIC, self.inode, self.indexed, count, self.fingerprint
+        )
+        if new_lines == count:
+            # new or rebuilt index
+            with open(self.index_path, "wb") as file:
+                file.write(header)
+                self.starts.tofile(file)
+            return
+        with open(self.index_path, "r+b") as file:
+            file.seek(INDEX_HEADER.size + (count - new_lines) * self.starts.itemsize)
+            self.starts[count - new_lines :].tofile(file)
+            file.truncate()
+            file.seek(0)
+            file.write(header)
+
+    def refresh(self):
+        """
+        Map and index what was appended since the last call.
+        """
+        stat = os.stat(self.path)
+        if stat.st_ino != self.inode:
+            # rotated, follow the path
+            self.file.close()
+            self.file = open(self.path, "rb")
+            self.inode = os.fstat(self.file.fileno()).st_ino
+            stat = os.fstat(self.file.fileno())
+            self.mm = None
+            self.starts = array.array("Q")
+            self.indexed = 0
+        size = stat.st_size
+        if size < self.indexed:
+            # truncated
+            self.mm = None
+            self.starts = array.array("Q")
+            self.indexed = 0
+        if size == 0:
+            self.mm = None
+            return
+        if self.mm is None or len(self.mm) != size:
+            # views handed out keep the previous mapping alive
+            self.mm = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+        if self.indexed and self.last_bytes() != self.fingerprint:
+            # truncated and written again past the indexed size, e.g. open(path, "w")
+            # or logrotate's copytruncate, the offsets are stale
+            self.starts = array.array("Q")
+            self.indexed = 0
+
+        rebuilt = self.indexed == 0
+        new_lines = 0
+        position = self.indexed
+        while True:
+            end = self.mm.find(b"\n", position)
+            if end == -1:
+                break
+            self.starts.append(position)
+            new_lines += 1
+            position = end + 1
+        if new_lines or rebuilt:
+            self.indexed = position
+            self.fingerprint = self.last_bytes()
+            self.save_index(len(self.starts) if rebuilt else new_lines)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def view(self, n):
+        start = self.starts[n]
+        end = self.starts[n + 1] if n + 1 < len(self.starts) else self.indexed
+        # without the newline
+        return memoryview(self.mm)[start : end - 1]
+
+    def line(self, n):
+        """
+        Line n, counting from 0, negative counts from the end.
+        """
+        self.refresh()
+        count = len(self.starts)
+        if n < 0:
+            n += count
+        if not 0 <= n < count:
+            raise IndexError(f"line {n} out of range, {count} lines")
+        return self.view(n)
+
+    def lines(self, start=0, stop=None):
+        """
+        Iterate over lines start up to stop, like a slice.
+        """
+        self.refresh()
+        for n in range(*slice(start, stop).indices(len(self.starts))):
+            yield self.view(n)
+
+    def tail(self, k):
+        """
+        The last k lines, oldest first.
+        """
+        self.refresh()
+        count = len(self.starts)
+        return [self.view(n) for n in range(max(count - k, 0), count)]
+
+    def close(self):
+        self.mm = None
+        self.file.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read lines of an append-only file by number.")
+    parser.add_argument("path", nargs="?", default="data/example.txt")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--line", type=int, help="print line N, negative counts from the end")
+    group.add_argument("--tail", type=int, default=10, help="print the last K lines")
+    group.add_argument("--range", type=int, nargs=2, metavar=("START", "STOP"), help="print lines START to STOP")
+    args = parser.parse_args()
+
+    with MmapReader(args.path) as reader:
+        if args.line is not None:
+            views = [reader.line(args.line)]
+        elif args.range is not None:
+            views = reader.lines(*args.range)
+        else:
+            views = reader.tail(args.tail)
+        for view in views:
+            print(bytes(view).decode())
@@ -5,7 +5,28 @@ from dotenv import load_dotenv
 import websockets
 from create_dotenv import create_dotenv
 import asyncio
-import json
+import collections
+import numpy as np
+import threading
+import time
+import game_protocol
+from entity_store import EntityStore, players_array
+from coalescing_queue import CoalescingQueue
+from logs import get_logger
+import runner
+
+log = get_logger("game_client")
+
+# messages received from the server, waiting for the game
+GAME_IN_QUEUE_SIZE = 256
+# messages waiting to be sent, newer positions replace queued ones
+GAME_OUT_QUEUE_SIZE = 64
+# frame rate cap, 0 runs uncapped
+FPS = int(os.getenv("FPS", "60"))
+# remote players are drawn this many seconds in the past, between two received positions
+INTERPOLATION_DELAY = float(os.getenv("INTERPOLATION_DELAY", "0.1"))
+# received positions kept per remote player
+SNAPSHOT_BUFFER_SIZE = 8
 
 
 class GameManager:
@@ -26,24 +47,33 @@ class GameManager:
 
     def __init__(self, server_address):
         self.server_address = server_address
-        self.game_in_queue = asyncio.Queue()
-        self.game_out_queue = asyncio.Queue()
+        # offer the binary wire format unless GAME_PROTOCOL=json, the server may still pick JSON
+        self.binary = os.getenv("GAME_PROTOCOL", "binary") == "binary"
+        # bounded, a slow game holds back reading from the server
+        self.game_in_queue = asyncio.Queue(maxsize=GAME_IN_QUEUE_SIZE)
+        # bounded, on a slow network only the newest position per player is kept
+        self.game_out_queue = CoalescingQueue(maxsize=GAME_OUT_QUEUE_SIZE)
 
     async def manage_game(self):
         # define game instance
         self.game = Game(
-            game_in_queue=self.game_in_queue, game_out_queue=self.game_out_queue
+            game_in_queue=self.game_in_queue,
+            game_out_queue=self.game_out_queue,
+            headless=os.getenv("HEADLESS") == "1",
         )
 
         # connect to server
-        async with websockets.connect(f"ws://{self.server_address}") as websocket:
+        async with websockets.connect(
+            f"ws://{self.server_address}",
+            subprotocols=game_protocol.subprotocols(binary=self.binary),
+        ) as websocket:
             self.websocket = websocket
+            self.game.binary = game_protocol.is_binary(websocket)
             # send and receive messages from the server asynchronously
             tasks = [
                 self.get_messages(),  # move messages from server to game_in_queue
                 self.game.process_in_queue(),  # continously look for new players, player movements in game_in_queue
-                self.game.async_run_game(),  # run the game continously, outputing new player movements in to_game_out_queue list
-                self.game.process_out_queue(),  # continously look for entries in to_game_out_queue and add to game_out_queue
+                self.game.async_run_game(),  # run the game continously in its own thread, handing new player movements to game_out_queue
                 self.send_messages(),  # move messages from game_out_queue to server
             ]
             await asyncio.gather(*tasks)
@@ -52,31 +82,27 @@ class GameManager:
         """
         Listen for messages on server and add them to queue.
         """
-        print("get_messages")
+        log.info("get_messages")
         while True:
             try:
                 message_text = await self.websocket.recv()
-                print(f"Message received from server: {message_text}")
                 await self.game_in_queue.put(message_text)
-                print(f"Message added to game_in_queue: {message_text}")
-            except Exception as e:
-                print(f"Exception: {e}")
+                log.sample("message_received", message=message_text)
+            except Exception:
+                log.exception("get_messages_failed")
 
     async def send_messages(self):
         """
         Listen for messages on queue and add them to server.
         """
-        print("send_messages")
+        log.info("send_messages")
         while True:
             try:
                 message_text = await self.game_out_queue.get()
-                print(f"Message received from game_out_queue: {message_text}")
-                # await self.game_out_queue.put(message_text)
-                # print(f"Message added back to game_out_queue: {message_text}")
                 await self.websocket.send(message_text)
-                print(f"Message added to server: {message_text}")
-            except Exception as e:
-                print(f"Exception: {e}")
+                log.sample("message_sent", message=message_text)
+            except Exception:
+                log.exception("send_messages_failed")
 
 
 class Player:
@@ -93,10 +119,28 @@ class Player:
 
 
 class Game:
-    def __init__(self, game_in_queue, game_out_queue):
+    def __init__(
+        self,
+        game_in_queue,
+        game_out_queue,
+        headless=False,
+        input_source=None,
+        fps=FPS,
+        max_frames=None,
+    ):
         self.game_in_queue = game_in_queue
         self.game_out_queue = game_out_queue
 
+        # headless runs without a display, for load tests and benchmarks
+        if headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+        # called once per frame with the frame number, returns the keys pressed
+        # defaults to the keyboard, scripted input replaces it when headless
+        self.input_source = input_source
+        self.fps = fps
+        # stop after this many frames, None runs until the window is closed
+        self.max_frames = max_frames
+
         # game vars
         self.screen = pygame.display.set_mode((1280, 720))
         self.clock = pygame.time.Clock()
@@ -108,38 +152,44 @@ class Game:
 
         # define intial player
         self.control_player = None
-        self.players = {}
+        # remote players, held as arrays
+        self.players = EntityStore(
+            interpolation_delay=INTERPOLATION_DELAY, history=SNAPSHOT_BUFFER_SIZE
+        )
+
+        # client side prediction, inputs applied locally that the server has not applied yet
+        self.input_seq = 0
+        self.pending_inputs = collections.deque()
+        # guards control_player.pos and pending_inputs, used by the game thread and the event loop
+        self.control_lock = threading.Lock()
 
-        # to game_out_queue
-        self.to_game_out_queue = []
+        # event loop the game thread hands messages to, set once the game starts
+        self.loop = None
+        # wire format, set once negotiated with the server
+        self.binary = False
 
-    async def process_out_queue(self):
+    def put_out_message(self, message):
         """
-        Read game state and update queue
+        Add a message staged by the game thread to game_out_queue, runs on the event loop.
         """
-        print("process_out_queue")
-        while True:
-            try:
-                if len(self.to_game_out_queue) == 0:
-                    await asyncio.sleep(self.dt)
-                else:
-                    message = self.to_game_out_queue.pop()
-                    await self.game_out_queue.put(json.dumps(message))
-                    print(f"Message added to game_out_queue: {json.dumps(message)}")
-
-            except Exception as e:
-                print(f"Exception: {e}")
+        try:
+            self.game_out_queue.put_nowait(
+                game_protocol.encode(message, binary=self.binary),
+                key=game_protocol.coalesce_key(message),
+            )
+        except asyncio.QueueFull:
+            # only possible with many keys queued, the next position supersedes this one
+            log.warning("game_out_queue_full", message=message)
 
     async def process_in_queue(self):
         """
         Read queue and update game state
         """
-        print("process_in_queue")
+        log.info("process_in_queue")
         while True:
             try:
                 message_text = await self.game_in_queue.get()
-                print(f"Message received from game_in_queue: {message_text}")
-                message = json.loads(message_text)
+                message = game_protocol.decode(message_text, raw_players=True)
                 message_type = message.get("type")
                 # server generated messages
                 if message_type == "new_connection":
@@ -147,42 +197,108 @@ class Game:
                 # client generated messages
                 elif message_type == "player_move":
                     await self.manage_player_move_message(message)
+                # server generated, latest position of every player once per tick
+                elif message_type == "snapshot":
+                    await self.manage_snapshot_message(message)
                 else:
                     continue
 
-            except Exception as e:
-                print(f"Exception: {e}")
+            except Exception:
+                log.exception("process_in_queue_failed")
 
     async def manage_new_connection_message(self, message):
-        print("managing new connection")
         id = message.get("id")
+        log.debug("new_connection", id=id)
         # check to see if control_player is set
         if self.control_player is None:
             # if not, set one
             self.control_player = Player(id=id, pos=self.init_player_pos)
-            self.players[id] = self.control_player
 
         # check to see if other players joined the game
         if self.control_player.id == int(id):
             pass
         else:
             # if other player joined the game, add to self.players
-            self.players[id] = Player(
-                id=id, pos=self.init_player_pos
+            self.players.add(
+                id, self.init_player_pos
             )  # spawn at initial position, will be updated next frame
 
     async def manage_player_move_message(self, message):
         """
         "player_move" type messages only possible after "new_connection" type messages.
         """
-        print("managing player move")
         id = message.get("id")
+        if self.control_player is not None and id == self.control_player.id:
+            self.reconcile(message)
+            return
         player_pos_x = message.get("pos_x")
         player_pos_y = message.get("pos_y")
-        player_ref = self.players[id]
-        player_ref.pos = pygame.Vector2(player_pos_x, player_pos_y)
-        self.players[id] = player_ref
-        print(f"Position updated: id: {id}, x: {player_pos_x}, y: {player_pos_x}")
+        self.players.update_positions(
+            [id],
+            [(player_pos_x, player_pos_y)],
+            received=time.monotonic(),
+            spawn_pos=self.init_player_pos,
+        )
+        log.sample("player_move", id=id, pos_x=player_pos_x, pos_y=player_pos_y)
+
+    def reconcile(self, message):
+        """
+        Start from the server's position for the controlled player and replay the inputs it has not applied yet.
+        """
+        seq = message.get("seq", 0)
+        with self.control_lock:
+            # inputs up to seq are included in the server's position
+            while self.pending_inputs and self.pending_inputs[0][0] <= seq:
+                self.pending_inputs.popleft()
+            pos = pygame.Vector2(message.get("pos_x"), message.get("pos_y"))
+            for _, keys, dt in self.pending_inputs:
+                pos = self.calc_position(pos=pos, keys=keys, dt=dt)
+            self.control_player.pos = pos
+
+    async def manage_snapshot_message(self, message):
+        """
+        "snapshot" messages hold the players changed or removed since the last acknowledged snapshot,
+        or with "full" set every player the client should know about.
+        """
+        players = players_array(message.get("players"))
+        log.sample(
+            "snapshot",
+            tick=message.get("tick"),
+            players=len(players),
+            removed=len(message.get("removed")),
+        )
+        own = players["id"] == self.control_player.id
+        for player in players[own]:
+            self.reconcile(
+                {
+                    "seq": int(player["seq"]),
+                    "pos_x": float(player["pos_x"]),
+                    "pos_y": float(player["pos_y"]),
+                }
+            )
+        # every remote player in the snapshot is updated at once
+        others = players[~own]
+        if len(others):
+            self.players.update_positions(
+                others["id"],
+                np.column_stack((others["pos_x"], others["pos_y"])),
+                received=time.monotonic(),
+                spawn_pos=self.init_player_pos,
+            )
+        for id in message.get("removed"):
+            self.players.pop(id, None)
+        if message.get("full"):
+            # players missing from a full snapshot were removed while this client was behind
+            current = set(others["id"].tolist())
+            for id in self.players:
+                if id not in current:
+                    self.players.pop(id, None)
+        # acknowledge, the next snapshot only holds changes made after this one
+        ack_message = {"type": "ack", "tick": message.get("tick")}
+        await self.game_out_queue.put(
+            game_protocol.encode(ack_message, binary=self.binary),
+            key=game_protocol.coalesce_key(ack_message),
+        )
 
     def calc_position(self, pos, keys, dt):
         """
@@ -197,65 +313,91 @@ class Game:
             player_pos.x -= 300 * dt
         if keys[pygame.K_d]:
             player_pos.x += 300 * dt
+        # same bounds the server enforces, so predictions agree with it
+        player_pos.x = min(max(player_pos.x, 0), self.screen.get_width())
+        player_pos.y = min(max(player_pos.y, 0), self.screen.get_height())
         return player_pos
 
     # send position, no loop because is only called after updating once per frame
-    def stage_position(self, id, pos):
+    def stage_position(self, id, pos, seq):
         """
         Stage player postion to be sent.
         """
-        print("send_position")
         player_pos_x = pos.x
         player_pos_y = pos.y
         message = {
             "type": "player_move",
             "id": id,
+            "seq": seq,
             "pos_x": player_pos_x,
             "pos_y": player_pos_y,
         }
-        self.to_game_out_queue.append(message)
+        # called from the game thread, wakes the event loop right away
+        self.loop.call_soon_threadsafe(self.put_out_message, message)
 
     def run_game(self):
         """
         Core game implementation.
         """
-        print("game_loop")
+        log.info("game_loop", headless=os.getenv("SDL_VIDEODRIVER") == "dummy")
         pygame.init()
 
+        frame = 0
         # poll for events
         while self.running:
+            if self.max_frames is not None and frame >= self.max_frames:
+                break
+            frame += 1
+
             # pygame.QUIT event means the user clicked X to close your window
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     self.running = False
 
             # fill the screen with a color to wipe away anything from last frame
-            print("color screen")
             self.screen.fill("purple")
 
             # draw each player
-            print("draw players")
-            print(self.players)
-            if len(self.players) > 0:
-                for player in self.players.values():
-                    print(f"Drawing player: {player.id}")
-                    player.draw(screen=self.screen)
-
-                print("press key")
-                keys = pygame.key.get_pressed()
-                print(
-                    f"w: {keys[pygame.K_w]}, a: {keys[pygame.K_a]}, s: {keys[pygame.K_s]}, d: {keys[pygame.K_d]}"
-                )
-
-                print("calc updated position")
-                # calculate updated position for the player being controlled
-                updated_player_pos = self.calc_position(
-                    pos=self.control_player.pos, keys=keys, dt=self.dt
-                )
-
-                # post updated pos to queue
-                print("stage position")
-                self.stage_position(id=self.control_player.id, pos=updated_player_pos)
+            # remote players are drawn a little in the past, so there is a
+            # received position either side to interpolate between
+            render_time = time.monotonic() - INTERPOLATION_DELAY
+            positions, colors = self.players.draw_list(render_time)
+            log.sample("frame", frame=frame, remote_players=len(positions), dt=self.dt)
+            for pos, color in zip(positions, colors):
+                pygame.draw.circle(self.screen, color, pos, 40)
+
+            if self.control_player is not None:
+                # drawn where prediction put it
+                self.control_player.draw(screen=self.screen)
+
+                if self.input_source is None:
+                    keys = pygame.key.get_pressed()
+                else:
+                    keys = self.input_source(frame)
+
+                with self.control_lock:
+                    # calculate updated position for the player being controlled
+                    updated_player_pos = self.calc_position(
+                        pos=self.control_player.pos, keys=keys, dt=self.dt
+                    )
+
+                    # post updated pos to queue, nothing is sent while the player is idle
+                    if updated_player_pos != self.control_player.pos:
+                        # predict, move now instead of waiting for the server's snapshot
+                        self.input_seq += 1
+                        self.pending_inputs.append((self.input_seq, keys, self.dt))
+                        self.control_player.pos = updated_player_pos
+                        log.sample(
+                            "position_staged",
+                            seq=self.input_seq,
+                            pos_x=updated_player_pos.x,
+                            pos_y=updated_player_pos.y,
+                        )
+                        self.stage_position(
+                            id=self.control_player.id,
+                            pos=updated_player_pos,
+                            seq=self.input_seq,
+                        )
 
             # sync back to queue happening in process_in_queue, async
             # new positions being loaded from server
@@ -263,41 +405,43 @@ class Game:
             # flip() the display to put your work on screen
             pygame.display.flip()
 
-            # limits FPS to 60
+            # limits FPS to self.fps, 60 by default
             # dt is delta time in seconds since last frame, used for framerate-
             # independent physics.
-            self.dt = self.clock.tick(1) / 1000
+            self.dt = self.clock.tick(self.fps) / 1000
 
         pygame.quit()
 
     async def async_run_game(self):
-        await asyncio.to_thread(self.run_game())
-
-
-while True:
-    try:
-        # Define the path to the .env file
-        dotenv_fp = os.path.join("config", ".env")
-        # Check if the .env file exists
-        exists = os.path.isfile(dotenv_fp)
-        # If the .env file does not exist, create it
-        if not exists:
-            create_dotenv()
-
-        # Load environment variables from the .env file, overriding existing ones
-        load_dotenv(dotenv_path=dotenv_fp, override=True)
-        # Retrieve the server address from the environment variables
-        SERVER_ADDRESS = os.getenv("SERVER_ADDRESS")
-        game_manager = GameManager(server_address=SERVER_ADDRESS)
-
-        # Attempt to send a message to the server
-        asyncio.run(game_manager.manage_game())
-
-        # If successful, break out of the loop
-        break
-
-    except Exception as e:
-        # If the connection fails, print the error and retry
-        print(f"Connection failed: {e}. Retry...")
-        # Optionally, remove the existing .env file before retrying
-        create_dotenv(remove=True)
+        self.loop = asyncio.get_running_loop()
+        await asyncio.to_thread(self.run_game)
+
+
+if __name__ == "__main__":
+    while True:
+        try:
+            # Define the path to the .env file
+            dotenv_fp = os.path.join("config", ".env")
+            # Check if the .env file exists
+            exists = os.path.isfile(dotenv_fp)
+            # If the .env file does not exist, create it
+            if not exists:
+                create_dotenv()
+
+            # Load environment variables from the .env file, overriding existing ones
+            load_dotenv(dotenv_path=dotenv_fp, override=True)
+            # Retrieve the server address from the environment variables
+            SERVER_ADDRESS = os.getenv("SERVER_ADDRESS")
+            game_manager = GameManager(server_address=SERVER_ADDRESS)
+
+            # Attempt to send a message to the server
+            runner.run(game_manager.manage_game())
+
+            # If successful, break out of the loop
+            break
+
+        except Exception as e:
+            # If the connection fails, log the error and retry
+            log.warning("connection_failed", error=str(e))
+            # Optionally, remove the existing .env file before retrying
+            create_dotenv(remove=True)
@@ -1,49 +1,138 @@
 import asyncio
+import logging
 import websockets
-import json
+import os
+from broadcaster import Broadcaster, PreparedMessage, deflate_extensions
+from game_world import IdAllocator, World
+import game_protocol
+from logs import get_logger
+import runner
+
+log = get_logger("game_server")
+
+# snapshots sent per second
+TICK_RATE = float(os.getenv("TICK_RATE", "20"))
+# clients only receive players within this distance of their own, unset sends every player
+AOI_RADIUS = float(os.getenv("AOI_RADIUS")) if os.getenv("AOI_RADIUS") else None
+# ticks a client may go without acknowledging a snapshot before it is sent the full state
+MAX_ACK_LAG = int(os.getenv("MAX_ACK_LAG", "100"))
 
 # track connected clients
 connected = {}
+ids = IdAllocator()
+broadcaster = Broadcaster()
+world = World(aoi_radius=AOI_RADIUS, max_ack_lag=MAX_ACK_LAG)
 
 
 # send messages to all connected
-async def broadcast(message):
-    for websocket in connected.values():
-        await websocket.send(message)
+def broadcast(message):
+    broadcaster.publish(message)
+
+
+# send each client what changed since its last acknowledged snapshot
+def send_snapshots():
+    world.advance()
+    # clients with the same view and wire format get the same delta, encode it once
+    deltas = {}
+    # clients that finished joining
+    for id in list(world.acked):
+        websocket = connected[id]
+        try:
+            binary = game_protocol.is_binary(websocket)
+            key = (world.view_key(id), binary)
+            if key not in deltas:
+                delta = world.delta_for(id)
+                deltas[key] = delta and PreparedMessage(
+                    game_protocol.encode(delta, binary=binary)
+                )
+            if deltas[key] is not None:
+                broadcaster.send(websocket, deltas[key])
+                world.sent(id)
+        except Exception:
+            # one client's snapshot failing must not stop the tick loop for everyone
+            log.exception("snapshot_failed", id=id)
+    world.prune()
+
+
+# send the latest state of every player once per tick
+async def tick_loop():
+    loop = asyncio.get_running_loop()
+    interval = 1 / TICK_RATE
+    next_tick = loop.time()
+    while True:
+        next_tick += interval
+        send_snapshots()
+        # schedule against a fixed clock so the tick rate does not drift
+        await asyncio.sleep(max(0, next_tick - loop.time()))
 
 
 # handle connected clients
 async def handler(websocket):
     # assign id to new connection
-    if len(connected) == 0:
-        id = 1
-    else:
-        id = max(connected.keys()) + 1
+    id = ids.allocate()
+
+    try:
+        # add the connected client
+        connected[id] = websocket
 
-    # add the connected client
-    connected[id] = websocket
+        # send id back to newly connected client
+        new_connection_message = {"type": "new_connection", "id": id}
+        await websocket.send(
+            game_protocol.encode(
+                new_connection_message, binary=game_protocol.is_binary(websocket)
+            )
+        )
+        log.info("new_connection", id=id, subprotocol=websocket.subprotocol)
 
-    # send id back to newly connected client
-    new_connection_message = {"type": "new_connection", "id": id}
-    await websocket.send(json.dumps(new_connection_message))
-    print(json.dumps(new_connection_message))
+        # only start receiving broadcasts once the client knows its id
+        broadcaster.add(websocket)
+        world.join(id)
 
-    try:
         # listen for messages from websocket
         async for message in websocket:
-            print(f"Message recieved:\n{message}")
-            # broadcast any message received to
-            await broadcast(message)
-    except Exception as e:
-        print(f"An error occurred: {e}")
+            log.sample("message_received", id=id, message=message)
+            data = game_protocol.decode(message)
+            if data.get("type") == "player_move":
+                # a client can only move itself
+                if data.get("id") != id:
+                    continue
+                # a bad seq or position would break encoding for every client
+                if not game_protocol.valid_move(data):
+                    log.sample("invalid_move", level=logging.WARNING, id=id, message=message)
+                    continue
+                # fold into the state table, sent with the next tick
+                world.move(id, data.get("pos_x"), data.get("pos_y"), data.get("seq", 0))
+            elif data.get("type") == "ack":
+                tick = data.get("tick")
+                if type(tick) is not int:
+                    log.sample("invalid_ack", level=logging.WARNING, id=id, message=message)
+                    continue
+                # client applied the snapshot, later deltas are relative to it
+                world.ack(id, tick)
+            else:
+                # broadcast any other message received
+                broadcast(message)
+    except Exception:
+        log.exception("handler_failed", id=id)
     finally:
-        connected.pop(id)
+        broadcaster.remove(websocket)
+        world.leave(id)
+        connected.pop(id, None)
+        log.info("disconnected", id=id)
+        ids.release(id)
 
 
 # main
 async def main():
-    async with websockets.serve(handler, "localhost", 8765):
-        await asyncio.Future()
+    async with websockets.serve(
+        handler,
+        "localhost",
+        8765,
+        extensions=deflate_extensions(),
+        subprotocols=game_protocol.subprotocols(),
+    ):
+        await tick_loop()
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    runner.run(main())
@@ -0,0 +1,225 @@
+import asyncio
+import concurrent.futures
+import os
+import time
+from logs import get_logger
+
+log = get_logger("pipeline")
+
+
+class Stage:
+    """
+    One step of a pipeline: `concurrency` workers take items from the stage's queue,
+    await func(item) and pass the result on to the next stage. A result of None is
+    not passed on, so a stage can also filter.
+    The queue is bounded by maxsize, a full queue holds back the stage feeding it.
+    Any queue with put, get, task_done and join can be given instead of asyncio.Queue.
+    """
+
+    def __init__(self, name, func, concurrency=1, maxsize=0, queue=None):
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.queue = queue if queue is not None else asyncio.Queue(maxsize)
+        # counters
+        self.processed = 0
+        self.failed = 0
+        # seconds spent in func, summed over the workers
+        self.busy = 0.0
+
+    async def work(self, next_stage):
+        while True:
+            item = await self.queue.get()
+            try:
+                start = time.perf_counter()
+                try:
+                    result = await self.func(item)
+                finally:
+                    self.busy += time.perf_counter() - start
+            except Exception:
+                self.failed += 1
+                log.exception("stage_failed", stage=self.name, item=item)
+            else:
+                self.processed += 1
+                if result is not None and next_stage is not None:
+                    await next_stage.queue.put(result)
+            finally:
+                # only after the result is queued, so joining the stages in order sees every item
+                self.queue.task_done()
+
+    def close(self):
+        pass
+
+
+def take_queued(queue, batch, size, limit, prepare, measure):
+    while size < limit and not queue.empty():
+        item = queue.get_nowait()
+        if prepare is not None:
+            item = prepare(item)
+        batch.append(item)
+        size += measure(item)
+    return size
+
+
+async def take_batch(queue, batch, limit, delay, prepare=None, measure=None):
+    """
+    Add items from queue to batch, which already holds the first one, until limit is
+    reached: what is queued now, then what arrives within delay seconds.
+    prepare converts each item as it is taken, measure gives its share of the limit,
+    1 by default. Items go into the caller's batch as they are taken, so none are lost
+    if this is cancelled. Returns the size of the batch.
+    """
+    measure = measure or (lambda item: 1)
+    size = take_queued(queue, batch, sum(map(measure, batch)), limit, prepare, measure)
+    if size < limit:
+        # let more items arrive, up to the batch delay
+        await asyncio.sleep(delay)
+        size = take_queued(queue, batch, size, limit, prepare, measure)
+    return size
+
+
+def apply_batch(func, items):
+    """
+    Runs in a worker process, one round trip for the whole batch.
+    Failures are returned per item so the rest of the batch still counts.
+    """
+    results = []
+    for item in items:
+        try:
+            results.append((func(item), None))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+
+class ProcessStage(Stage):
+    """
+    Stage for CPU-bound work, func(item) runs in a process pool instead of on the event loop.
+    Items are sent in batches of up to batch_size, waiting at most batch_delay seconds
+    to fill one, so the cost of pickling and the round trip is shared by the batch.
+    `concurrency` batches are in flight at once, by default one per CPU.
+    func must be a plain function defined at module level, so it can be pickled.
+    Any concurrent.futures executor can be given instead, such as an interpreter pool,
+    it is then left to the caller to shut down.
+    """
+
+    def __init__(
+        self,
+        name,
+        func,
+        concurrency=None,
+        maxsize=0,
+        queue=None,
+        batch_size=64,
+        batch_delay=0.01,
+        executor=None,
+    ):
+        concurrency = concurrency or os.cpu_count()
+        super().__init__(name, func, concurrency, maxsize, queue)
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.owns_executor = executor is None
+        self.executor = executor or concurrent.futures.ProcessPoolExecutor(concurrency)
+        # batches sent to the pool
+        self.batches = 0
+
+    async def work(self, next_stage):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            try:
+                await take_batch(self.queue, batch, self.batch_size, self.batch_delay)
+                start = time.perf_counter()
+                try:
+                    results = await loop.run_in_executor(
+                        self.executor, apply_batch, self.func, batch
+                    )
+                finally:
+                    self.busy += time.perf_counter() - start
+                self.batches += 1
+                for item, (result, error) in zip(batch, results):
+                    if error is not None:
+                        self.failed += 1
+                        log.error("stage_failed", stage=self.name, item=item, error=repr(error))
+                        continue
+                    self.processed += 1
+                    if result is not None and next_stage is not None:
+                        await next_stage.queue.put(result)
+            except Exception:
+                # the batch could not be sent or run, e.g. an item that does not pickle
+                self.failed += len(batch)
+                log.exception("stage_failed", stage=self.name, items=len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def close(self):
+        if self.owns_executor:
+            self.executor.shutdown(cancel_futures=True)
+
+
+class Pipeline:
+    """
+    Producers put items into the first stage, each stage feeds the next.
+    run() returns once the producers are done and every item has been through every stage.
+    Shutdown joins the stages in order instead of sending sentinels, so it is correct
+    with any number of workers per stage.
+    """
+
+    def __init__(self, *stages):
+        self.stages = stages
+        self.elapsed = 0.0
+
+    async def put(self, item, **options):
+        """
+        Queue item for the first stage, options such as priority or ttl are passed to its queue.
+        """
+        await self.stages[0].queue.put(item, **options)
+
+    async def run(self, producers):
+        """
+        Run the producer coroutines and the stages until everything produced is processed.
+        """
+        start = time.perf_counter()
+        workers = []
+        for stage, next_stage in zip(self.stages, self.stages[1:] + (None,)):
+            workers.extend(
+                asyncio.create_task(stage.work(next_stage))
+                for _ in range(stage.concurrency)
+            )
+        try:
+            await asyncio.gather(*producers)
+            for stage in self.stages:
+                # nothing more can arrive at this stage once the previous ones are drained
+                await stage.queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            for stage in self.stages:
+                stage.close()
+            self.elapsed = time.perf_counter() - start
+
+    def stats(self):
+        """
+        Counters per stage. utilization is the share of the workers' time spent in func,
+        near 1 the stage is the bottleneck and more concurrency may help.
+        """
+        return {
+            stage.name: {
+                "processed": stage.processed,
+                "failed": stage.failed,
+                "per_second": stage.processed / self.elapsed if self.elapsed else 0.0,
+                "utilization": stage.busy / (self.elapsed * stage.concurrency)
+                if self.elapsed
+                else 0.0,
+            }
+            for stage in self.stages
+        }
+
+    def report(self):
+        for name, stats in self.stats().items():
+            print(
+                f"{name}: {stats['processed']} processed, {stats['failed']} failed, "
+                f"{stats['per_second']:.1f}/s, {stats['utilization']:.0%} busy"
+            )
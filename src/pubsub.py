@@ -0,0 +1,142 @@
+import asyncio
+import os
+import socket
+import struct
+from broadcaster import DROP_NEWEST, DROP_OLDEST
+
+# broadcaster's policies except disconnect, a worker cut off from the hub would exit
+# and take its clients with it
+HUB_OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST)
+# frames buffered in the hub for each worker, and what happens when a worker falls behind
+HUB_QUEUE_SIZE = int(os.getenv("HUB_QUEUE_SIZE", "1024"))
+HUB_OVERFLOW = os.getenv("HUB_OVERFLOW", DROP_OLDEST)
+
+# frame header: kind (text or binary), payload length
+HEADER = struct.Struct("<BI")
+TEXT = 0
+BINARY = 1
+
+
+def listen(path):
+    """
+    Bind the hub's unix socket before forking, so workers can connect as soon as they start.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen()
+    return sock
+
+
+class WorkerWriter:
+    """
+    Bounded queue of frames and writer task for one worker's connection to the hub.
+    A worker that is slow to read only delays its own frames, the hub keeps reading
+    from every worker.
+    """
+
+    def __init__(self, writer, max_queue, overflow):
+        self.writer = writer
+        self.overflow = overflow
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.task = asyncio.create_task(self.write())
+
+    def push(self, frame):
+        """
+        Queue a frame without blocking, applying the overflow policy when the queue is full.
+        """
+        if not self.queue.full():
+            self.queue.put_nowait(frame)
+        elif self.overflow == DROP_OLDEST:
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+            self.dropped += 1
+        else:
+            self.dropped += 1
+
+    async def write(self):
+        while True:
+            self.writer.write(await self.queue.get())
+            # whatever else is queued goes out with it
+            while not self.queue.empty():
+                self.writer.write(self.queue.get_nowait())
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                break
+
+    def close(self):
+        self.task.cancel()
+        self.writer.close()
+
+
+class Hub:
+    """
+    Relay between worker processes, every message published by a worker is sent to all the others.
+    """
+
+    def __init__(self, max_queue=HUB_QUEUE_SIZE, overflow=HUB_OVERFLOW):
+        if overflow not in HUB_OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy: {overflow}, expected one of {HUB_OVERFLOW_POLICIES}"
+            )
+        self.max_queue = max_queue
+        self.overflow = overflow
+        # stream writer -> WorkerWriter of each connected worker
+        self.workers = {}
+
+    async def serve(self, sock):
+        server = await asyncio.start_unix_server(self.handle, sock=sock)
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        worker = WorkerWriter(writer, max_queue=self.max_queue, overflow=self.overflow)
+        self.workers[writer] = worker
+        try:
+            while True:
+                header = await reader.readexactly(HEADER.size)
+                _, length = HEADER.unpack(header)
+                frame = header + await reader.readexactly(length)
+                # never waits on the other workers, so one slow worker cannot stall the
+                # rest and the publisher is always read from
+                for other in list(self.workers.values()):
+                    if other is not worker:
+                        other.push(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # worker exited
+            pass
+        finally:
+            self.workers.pop(writer, None)
+            worker.close()
+
+
+class HubClient:
+    """
+    A worker's connection to the hub.
+    """
+
+    async def connect(self, path):
+        self.reader, self.writer = await asyncio.open_unix_connection(path)
+
+    def publish(self, message):
+        if isinstance(message, str):
+            kind, payload = TEXT, message.encode()
+        else:
+            kind, payload = BINARY, bytes(message)
+        self.writer.write(HEADER.pack(kind, len(payload)) + payload)
+
+    async def messages(self):
+        """
+        Yield the messages published by the other workers until the hub goes away.
+        """
+        while True:
+            try:
+                header = await self.reader.readexactly(HEADER.size)
+                kind, length = HEADER.unpack(header)
+                payload = await self.reader.readexactly(length)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return
+            yield payload.decode() if kind == TEXT else payload
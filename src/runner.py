@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import concurrent.futures
+import importlib
+import os
+import sys
+import time
+from logs import get_logger
+
+log = get_logger("runner")
+
+# event loop implementation: auto (uvloop when installed), uvloop, asyncio,
+# or module:factory for any function returning a new loop
+EVENT_LOOP = os.getenv("EVENT_LOOP", "auto")
+# threads in the default executor, used by asyncio.to_thread and aiofiles, 0 keeps asyncio's default
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", "0"))
+# asyncio debug mode, slow, for development only
+ASYNCIO_DEBUG = os.getenv("ASYNCIO_DEBUG") == "1"
+# warn when the loop is blocked this many seconds, 0 turns it off
+SLOW_CALLBACK = float(os.getenv("SLOW_CALLBACK", "0"))
+
+
+def add_arguments(parser):
+    """
+    Runner options for scripts with their own argument parser, defaults from the environment.
+    """
+    group = parser.add_argument_group("event loop")
+    group.add_argument("--loop", default=EVENT_LOOP, help="auto, uvloop, asyncio or module:factory")
+    group.add_argument(
+        "--executor-workers", type=int, default=EXECUTOR_WORKERS, help="default executor threads"
+    )
+    group.add_argument(
+        "--asyncio-debug", action="store_true", default=ASYNCIO_DEBUG, help="asyncio debug mode"
+    )
+    group.add_argument(
+        "--slow-callback",
+        type=float,
+        default=SLOW_CALLBACK,
+        help="warn when the loop is blocked this many seconds",
+    )
+    return parser
+
+
+def parse_args(argv=None):
+    """
+    Runner options from the command line, anything else is left to the script.
+    """
+    options, _ = add_arguments(argparse.ArgumentParser(add_help=False)).parse_known_args(argv)
+    return options
+
+
+def loop_factory(name):
+    if name in ("auto", "uvloop"):
+        try:
+            import uvloop
+        except ImportError:
+            if name == "uvloop":
+                raise
+            return asyncio.new_event_loop
+        return uvloop.new_event_loop
+    if name == "asyncio":
+        return asyncio.new_event_loop
+    module, _, factory = name.partition(":")
+    return getattr(importlib.import_module(module), factory)
+
+
+async def watch_lag(threshold):
+    """
+    Warn when a wakeup comes threshold seconds or more late, something held the loop that long.
+    Cheap enough to leave on, unlike debug mode's per callback timing.
+    """
+    interval = threshold / 2
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = time.perf_counter() - start - interval
+        if lag >= threshold:
+            log.warning("loop_blocked", seconds=round(lag, 4))
+
+
+async def configured(main, options):
+    loop = asyncio.get_running_loop()
+    if options.executor_workers:
+        loop.set_default_executor(
+            concurrent.futures.ThreadPoolExecutor(max_workers=options.executor_workers)
+        )
+    watcher = None
+    if options.slow_callback:
+        # debug mode names the slow callback itself
+        loop.slow_callback_duration = options.slow_callback
+        watcher = asyncio.create_task(watch_lag(options.slow_callback))
+    log.info(
+        "event_loop",
+        loop=type(loop).__module__ + "." + type(loop).__name__,
+        executor_workers=options.executor_workers or None,
+        debug=options.asyncio_debug,
+        slow_callback=options.slow_callback or None,
+    )
+    try:
+        return await main
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+
+
+def run(main, options=None):
+    """
+    asyncio.run with the event loop, default executor and debugging set by the runner options,
+    parsed from sys.argv and the environment unless given.
+    """
+    if options is None:
+        options = parse_args(sys.argv[1:])
+    factory = loop_factory(options.loop)
+    if not hasattr(asyncio, "Runner"):
+        # before python 3.11, run the loop by hand
+        loop = factory()
+        loop.set_debug(options.asyncio_debug)
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(configured(main, options))
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            asyncio.set_event_loop(None)
+            loop.close()
+    with asyncio.Runner(loop_factory=factory, debug=options.asyncio_debug) as runner:
+        return runner.run(configured(main, options))
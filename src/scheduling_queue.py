@@ -0,0 +1,152 @@
+import asyncio
+import collections
+import heapq
+import itertools
+import time
+
+
+class Entry:
+    __slots__ = ("item", "live")
+
+    def __init__(self, item):
+        self.item = item
+        # until taken by get or expired
+        self.live = True
+
+
+class SchedulingQueue:
+    """
+    Drop-in for asyncio.Queue that schedules instead of serving strictly in order:
+    - lower priority numbers are served first,
+    - within a priority, producer keys take turns, so one busy producer cannot starve the rest,
+    - an item past its deadline is dropped before any work is spent on it, and marked
+      done so join() does not wait for it.
+    put(item) with no options behaves like asyncio.Queue.
+    """
+
+    def __init__(self, maxsize=0, on_expired=None):
+        self.maxsize = maxsize
+        # called with each item dropped for being past its deadline
+        self.on_expired = on_expired
+        # priority -> key -> entries in arrival order, keys in turn order
+        self.levels = {}
+        # (deadline, n, entry) of entries with a deadline, soonest first
+        self.deadlines = []
+        self.counter = itertools.count()
+        # live entries, expired ones stay in self.levels until their turn comes
+        self.size = 0
+        self.unfinished = 0
+        # number of items dropped for being past their deadline
+        self.expired = 0
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+        self.finished = asyncio.Event()
+        self.finished.set()
+
+    def expire(self):
+        now = time.monotonic()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, _, entry = heapq.heappop(self.deadlines)
+            if not entry.live:
+                continue
+            entry.live = False
+            self.size -= 1
+            self.expired += 1
+            if self.on_expired is not None:
+                self.on_expired(entry.item)
+            # dropped, as if a consumer handled it
+            self.task_done()
+        self.update_events()
+
+    def update_events(self):
+        if self.size:
+            self.not_empty.set()
+        else:
+            self.not_empty.clear()
+        if self.full():
+            self.not_full.clear()
+        else:
+            self.not_full.set()
+
+    def qsize(self):
+        self.expire()
+        return self.size
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return 0 < self.maxsize <= self.size
+
+    def put_nowait(self, item, priority=0, key=None, ttl=None, deadline=None):
+        """
+        Queue item. deadline is a time.monotonic() time, or ttl seconds from now.
+        key names the producer, for fair turns between producers.
+        """
+        self.expire()
+        if self.full():
+            raise asyncio.QueueFull
+        if ttl is not None:
+            deadline = time.monotonic() + ttl
+        entry = Entry(item)
+        self.levels.setdefault(priority, collections.OrderedDict()).setdefault(
+            key, collections.deque()
+        ).append(entry)
+        if deadline is not None:
+            heapq.heappush(self.deadlines, (deadline, next(self.counter), entry))
+        self.size += 1
+        self.unfinished += 1
+        self.finished.clear()
+        self.update_events()
+
+    async def put(self, item, priority=0, key=None, ttl=None, deadline=None):
+        self.expire()
+        while self.full():
+            # queued items past their deadline make room without a consumer, wake up for the next one
+            timeout = self.deadlines[0][0] - time.monotonic() if self.deadlines else None
+            try:
+                await asyncio.wait_for(self.not_full.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.expire()
+        self.put_nowait(item, priority=priority, key=key, ttl=ttl, deadline=deadline)
+
+    def get_nowait(self):
+        self.expire()
+        if not self.size:
+            raise asyncio.QueueEmpty
+        while True:
+            priority = min(self.levels)
+            keys = self.levels[priority]
+            key, entries = next(iter(keys.items()))
+            entry = entries.popleft()
+            if entries:
+                # the next turn at this priority goes to the next key
+                keys.move_to_end(key)
+            else:
+                del keys[key]
+                if not keys:
+                    del self.levels[priority]
+            if entry.live:
+                break
+        # taken, the deadline heap skips it
+        entry.live = False
+        self.size -= 1
+        self.update_events()
+        return entry.item
+
+    async def get(self):
+        while self.empty():
+            await self.not_empty.wait()
+        return self.get_nowait()
+
+    def task_done(self):
+        if self.unfinished <= 0:
+            raise ValueError("task_done() called too many times")
+        self.unfinished -= 1
+        if self.unfinished == 0:
+            self.finished.set()
+
+    async def join(self):
+        await self.finished.wait()
@@ -0,0 +1,92 @@
+import argparse
+import concurrent.futures
+import json
+import time
+import numpy as np
+from shm_transport import ShmPool
+
+# payload sizes compared, 1 KB to 100 MB
+SIZES = [1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024, 100 * 1024 * 1024]
+
+
+def touch(payload):
+    """
+    Read one byte per page, so the payload has to be there without the work itself dominating.
+    """
+    data = np.frombuffer(payload, dtype=np.uint8)
+    return int(data[::4096].sum())
+
+
+def make_payloads(size, count, kind):
+    payloads = []
+    for i in range(count):
+        array = np.full(size, i % 256, dtype=np.uint8)
+        payloads.append(array if kind == "numpy" else array.tobytes())
+    return payloads
+
+
+def run_pickle(executor, payloads):
+    start = time.perf_counter()
+    results = list(executor.map(touch, payloads))
+    return time.perf_counter() - start, results
+
+
+def run_shm(pool, payloads):
+    start = time.perf_counter()
+    results = pool.map(payloads)
+    return time.perf_counter() - start, results
+
+
+def benchmark(args):
+    # room for a few of the largest payloads in flight
+    ring_size = max(4 * max(args.sizes), 64 * 1024 * 1024)
+    rows = []
+    with concurrent.futures.ProcessPoolExecutor(args.processes) as executor, ShmPool(
+        touch, processes=args.processes, ring_size=ring_size
+    ) as pool:
+        # start the workers before timing
+        run_pickle(executor, make_payloads(1024, args.processes, args.kind))
+        run_shm(pool, make_payloads(1024, args.processes, args.kind))
+        for size in args.sizes:
+            # about args.total bytes per size, at least 4 payloads
+            count = max(4, min(1000, args.total // size))
+            payloads = make_payloads(size, count, args.kind)
+            pickle_time, pickle_results = run_pickle(executor, payloads)
+            shm_time, shm_results = run_shm(pool, payloads)
+            assert pickle_results == shm_results
+            rows.append(
+                {
+                    "size": size,
+                    "count": count,
+                    "pickle_mb_per_sec": size * count / pickle_time / 1e6,
+                    "shm_mb_per_sec": size * count / shm_time / 1e6,
+                    "pickle_ms_per_payload": pickle_time / count * 1000,
+                    "shm_ms_per_payload": shm_time / count * 1000,
+                    "speedup": pickle_time / shm_time,
+                }
+            )
+
+    if args.json:
+        print(json.dumps(rows))
+        return
+    print(f"{args.kind} payloads, {args.processes} processes")
+    print(f"{'size':>10} {'count':>6} {'pickle MB/s':>12} {'shm MB/s':>10} {'pickle ms':>10} {'shm ms':>8} {'speedup':>8}")
+    for row in rows:
+        print(
+            f"{row['size']:>10} {row['count']:>6} "
+            f"{row['pickle_mb_per_sec']:>12.1f} {row['shm_mb_per_sec']:>10.1f} "
+            f"{row['pickle_ms_per_payload']:>10.3f} {row['shm_ms_per_payload']:>8.3f} "
+            f"{row['speedup']:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Moving payloads to worker processes: pickled through a ProcessPoolExecutor vs a shared memory ring."
+    )
+    parser.add_argument("--kind", choices=["numpy", "bytes"], default="numpy")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="payload sizes in bytes")
+    parser.add_argument("--total", type=int, default=400 * 1024 * 1024, help="bytes sent per size")
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    benchmark(parser.parse_args())
@@ -0,0 +1,275 @@
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+
+# bytes of shared memory the payloads in flight are written to
+SHM_RING_SIZE = int(os.getenv("SHM_RING_SIZE", str(256 * 1024 * 1024)))
+# slots start on a cache line, which also suits any numpy dtype
+ALIGNMENT = 64
+# seconds between checks that the workers are still alive while no results arrive
+WORKER_CHECK_INTERVAL = 0.1
+
+
+class Slot:
+    """
+    Space reserved in the ring for one payload, with a numpy view to fill in place.
+    """
+
+    def __init__(self, start, size, nbytes, shape, dtype, array):
+        # ring position and bytes taken in the ring, nbytes rounded up to ALIGNMENT
+        self.start = start
+        self.size = size
+        self.nbytes = nbytes
+        self.shape = shape
+        self.dtype = dtype
+        self.array = array
+        # set by the results thread once a worker is done reading it
+        self.done = False
+
+
+def call(func, payload):
+    """
+    Pickled (result, error) of func(payload). Pickled here rather than by the results
+    queue, whose feeder thread drops what fails to pickle and would leave the future
+    waiting forever, so an unpicklable result or exception is sent as an error instead.
+    """
+    try:
+        return pickle.dumps((func(payload), None))
+    except Exception as e:
+        error = e
+    try:
+        return pickle.dumps((None, error))
+    except Exception:
+        return pickle.dumps((None, RuntimeError(repr(error))))
+
+
+def worker_main(shm_name, func, tasks, results):
+    """
+    Worker process: attach to the ring, call func on a view of each payload, send back the result.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            task_id, start, nbytes, shape, dtype = task
+            if dtype is None:
+                payload = shm.buf[start : start + nbytes]
+            else:
+                payload = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+            results.put((task_id, call(func, payload)))
+            # views must be released before the segment can be closed
+            if dtype is None:
+                payload.release()
+            del payload
+    finally:
+        shm.close()
+
+
+def settle(future, result, error):
+    """
+    Complete a future with its result or error. A future that is already done is left
+    as it is, rather than the error stopping the results thread.
+    """
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except concurrent.futures.InvalidStateError:
+        pass
+
+
+class ShmPool:
+    """
+    Process pool that passes NumPy arrays and bytes to its workers through a shared
+    memory ring buffer instead of pickling them. Only a small descriptor (offset, size,
+    dtype, shape) goes through the task queue, the worker reads the payload in place.
+    The ring is allocated in order and freed as the oldest payloads are done with, a
+    submit waits while it is full. Results come back pickled, so they should be small.
+    func receives a numpy array for array payloads and a memoryview for bytes, valid
+    only during the call, and must be a plain function defined at module level.
+    If a worker dies, the pool is broken like a ProcessPoolExecutor: every pending
+    future fails with BrokenProcessPool and later submits raise it.
+    """
+
+    def __init__(self, func, processes=None, ring_size=SHM_RING_SIZE):
+        self.ring_size = ring_size
+        self.shm = shared_memory.SharedMemory(create=True, size=ring_size)
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.workers = [
+            multiprocessing.Process(
+                target=worker_main,
+                args=(self.shm.name, func, self.tasks, self.results),
+                daemon=True,
+            )
+            for _ in range(processes or os.cpu_count())
+        ]
+        for worker in self.workers:
+            worker.start()
+        # ring positions count up forever, the offset in the segment is position % ring_size
+        self.head = 0
+        self.tail = 0
+        # slots not yet freed, oldest first
+        self.slots = collections.deque()
+        self.futures = {}
+        self.next_id = 0
+        # set when a worker died, to the reason
+        self.broken = None
+        self.closing = False
+        self.changed = threading.Condition()
+        self.reader = threading.Thread(target=self.read_results, daemon=True)
+        self.reader.start()
+
+    def read_results(self):
+        while True:
+            try:
+                message = self.results.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                self.check_workers()
+                continue
+            if message is None:
+                break
+            task_id, data = message
+            with self.changed:
+                # gone if the pool broke in the meantime
+                entry = self.futures.pop(task_id, None)
+                if entry is None:
+                    continue
+                future, slot = entry
+                slot.done = True
+                # free from the oldest, a slot done early waits for the ones before it
+                while self.slots and self.slots[0].done:
+                    freed = self.slots.popleft()
+                    self.tail = freed.start + freed.size
+                self.changed.notify_all()
+            try:
+                result, error = pickle.loads(data)
+            except Exception as e:
+                result, error = None, e
+            settle(future, result, error)
+
+    def check_workers(self):
+        """
+        Break the pool if a worker died, its tasks would never complete.
+        """
+        if self.closing or self.broken is not None:
+            return
+        dead = [worker for worker in self.workers if not worker.is_alive()]
+        if not dead:
+            return
+        with self.changed:
+            self.broken = (
+                f"worker process {dead[0].pid} exited with code {dead[0].exitcode}, "
+                "the pool is no longer usable"
+            )
+            futures = list(self.futures.values())
+            self.futures.clear()
+            # nothing will read the reserved space any more
+            self.slots.clear()
+            self.tail = self.head
+            self.changed.notify_all()
+        for future, _ in futures:
+            settle(future, None, concurrent.futures.process.BrokenProcessPool(self.broken))
+
+    def reserve(self, shape, dtype=np.uint8):
+        """
+        Slot for an array of shape and dtype, fill slot.array then submit the slot,
+        to build a payload in shared memory without copying it.
+        """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        size = -(-max(nbytes, 1) // ALIGNMENT) * ALIGNMENT
+        if size > self.ring_size:
+            raise ValueError(f"payload of {nbytes} bytes is larger than the {self.ring_size} byte ring")
+        with self.changed:
+            while True:
+                if self.broken is not None:
+                    raise concurrent.futures.process.BrokenProcessPool(self.broken)
+                start = self.head
+                offset = start % self.ring_size
+                if offset + size > self.ring_size:
+                    # does not fit before the end, skip to the start of the ring
+                    start += self.ring_size - offset
+                    offset = 0
+                if start + size - self.tail <= self.ring_size:
+                    break
+                self.changed.wait()
+            self.head = start + size
+            array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            slot = Slot(start, size, nbytes, shape, dtype, array)
+            self.slots.append(slot)
+        return slot
+
+    def submit(self, payload):
+        """
+        Send a payload to a worker, returns a concurrent.futures.Future of func's result.
+        payload is a Slot from reserve, a numpy array or bytes-like, the last two are copied in.
+        """
+        if isinstance(payload, Slot):
+            slot = payload
+            kind = slot.dtype
+        elif isinstance(payload, np.ndarray):
+            slot = self.reserve(payload.shape, payload.dtype)
+            slot.array[...] = payload
+            kind = slot.dtype
+        else:
+            data = memoryview(payload).cast("B")
+            slot = self.reserve(len(data))
+            slot.array[:] = data
+            # the worker gets a memoryview
+            kind = None
+        # the worker reads the data itself, the pool no longer needs the view
+        slot.array = None
+        future = concurrent.futures.Future()
+        # running from the start, like an executor's futures, so cancel() cannot
+        # complete it behind the reader thread's back
+        future.set_running_or_notify_cancel()
+        with self.changed:
+            if self.broken is not None:
+                raise concurrent.futures.process.BrokenProcessPool(self.broken)
+            task_id = self.next_id
+            self.next_id += 1
+            self.futures[task_id] = (future, slot)
+        self.tasks.put(
+            (task_id, slot.start % self.ring_size, slot.nbytes, slot.shape, kind)
+        )
+        return future
+
+    def map(self, payloads):
+        """
+        func applied to each payload, in order.
+        """
+        futures = [self.submit(payload) for payload in payloads]
+        return [future.result() for future in futures]
+
+    def close(self):
+        # workers exiting from here on are not a failure
+        self.closing = True
+        for _ in self.workers:
+            self.tasks.put(None)
+        if self.broken is not None:
+            # a dead worker may have held the task queue's lock, the rest would never see None
+            for worker in self.workers:
+                worker.terminate()
+        for worker in self.workers:
+            worker.join()
+        self.results.put(None)
+        self.reader.join()
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
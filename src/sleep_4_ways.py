@@ -2,6 +2,8 @@ import time
 import threading
 import multiprocessing
 import asyncio
+import numpy as np
+from shm_transport import ShmPool
 
 
 # defined workloads
@@ -12,6 +14,15 @@ def sleep(i=1):
     print(f"end: #{i}")
 
 
+# process pool with data, the payload arrives through shared memory
+def sleep_with_payload(payload):
+    i = int(payload[0])
+    print(f"start: #{i}, {payload.nbytes} bytes")
+    time.sleep(1)
+    print(f"end: #{i}")
+    return i
+
+
 # async
 async def sleep_async(i=1):
     print(f"start: #{i}")
@@ -78,3 +89,12 @@ for process in processes:
     process.join()
     # everything after here (after the join) runs synchronously
     print(f"time elapsed {time.perf_counter() - rt}")
+
+
+# processing, moving data
+# 1 second, the payloads are passed in shared memory instead of being pickled
+print("10 processing calls with 1 MB payloads in shared memory")
+rt = time.perf_counter()
+with ShmPool(sleep_with_payload, processes=10) as pool:
+    pool.map([np.full(1024 * 1024, i, dtype=np.uint8) for i in range(10)])
+print(f"time elapsed {time.perf_counter() - rt}")
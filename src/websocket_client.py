@@ -4,6 +4,7 @@ import websockets
 from create_dotenv import create_dotenv
 import asyncio
 import json
+import runner
 
 
 class AsyncClient:
@@ -11,6 +12,8 @@ class AsyncClient:
         self.name = input("Enter username (public):\n")
         self.clear_screen()
         self.server_address = server_address
+        # room messages are sent to, change with /join <room>
+        self.room = "lobby"
         self.msgs_sent = []
         self.msgs_recieved = []
 
@@ -18,11 +21,26 @@ class AsyncClient:
     async def async_input(self, prompt):
         return await asyncio.to_thread(input, prompt)
 
+    # build the message for the text typed, commands:
+    # /join <room>, /leave <room>, /msg <username> <text>
+    def build_message(self, message_text):
+        command, _, args = message_text.partition(" ")
+        if command in ("/join", "/leave") and args:
+            if command == "/join":
+                self.room = args
+            elif self.room == args:
+                self.room = "lobby"
+            return {"type": command[1:], "name": self.name, "room": args}
+        if command == "/msg" and " " in args:
+            to, text = args.split(" ", 1)
+            return {"name": self.name, "message_text": text, "to": to}
+        return {"name": self.name, "message_text": message_text, "room": self.room}
+
     # send message and store in msgs_sent
     async def send_message(self, websocket):
         while True:
             message_text = await self.async_input(prompt=f"(you) {self.name}:\n")
-            message = {"name": self.name, "message_text": message_text}
+            message = self.build_message(message_text)
             await websocket.send(json.dumps(message))
             self.msgs_sent.append(message_text)
 
@@ -41,7 +59,13 @@ class AsyncClient:
                 for msg in self.msgs_recieved[
                     -len(self.msgs_recieved) :
                 ]:  # show only last n messages
-                    print(msg.get("name") + ": " + msg.get("message_text"))
+                    if msg.get("to") is not None:
+                        prefix = f"(to {msg.get('to')}) "
+                    elif msg.get("room", "lobby") != "lobby":
+                        prefix = f"[{msg.get('room')}] "
+                    else:
+                        prefix = ""
+                    print(prefix + msg.get("name") + ": " + msg.get("message_text"))
                 print(f"(you) {self.name}:")
             except websockets.ConnectionClosed as e:
                 print(f"Connection closed: {e.reason}")
@@ -51,6 +75,10 @@ class AsyncClient:
     async def client_handler(self):
         # connect to server
         async with websockets.connect(f"ws://{self.server_address}") as websocket:
+            # register the username so direct messages can reach this client
+            await websocket.send(
+                json.dumps({"type": "join", "name": self.name, "room": self.room})
+            )
             # send and receive messages from the server asynchronously
             tasks = [self.send_message(websocket), self.recieve_messages(websocket)]
             await asyncio.gather(*tasks)
@@ -61,30 +89,31 @@ class AsyncClient:
 
 
 # Main loop to attempt to connect to the server
-while True:
-    try:
-        # Define the path to the .env file
-        dotenv_fp = os.path.join("config", ".env")
-        # Check if the .env file exists
-        exists = os.path.isfile(dotenv_fp)
-        # If the .env file does not exist, create it
-        if not exists:
-            create_dotenv()
+if __name__ == "__main__":
+    while True:
+        try:
+            # Define the path to the .env file
+            dotenv_fp = os.path.join("config", ".env")
+            # Check if the .env file exists
+            exists = os.path.isfile(dotenv_fp)
+            # If the .env file does not exist, create it
+            if not exists:
+                create_dotenv()
 
-        # Load environment variables from the .env file, overriding existing ones
-        load_dotenv(dotenv_path=dotenv_fp, override=True)
-        # Retrieve the server address from the environment variables
-        SERVER_ADDRESS = os.getenv("SERVER_ADDRESS")
-        client = AsyncClient(server_address=SERVER_ADDRESS)
+            # Load environment variables from the .env file, overriding existing ones
+            load_dotenv(dotenv_path=dotenv_fp, override=True)
+            # Retrieve the server address from the environment variables
+            SERVER_ADDRESS = os.getenv("SERVER_ADDRESS")
+            client = AsyncClient(server_address=SERVER_ADDRESS)
 
-        # Attempt to send a message to the server
-        asyncio.run(client.client_handler())
+            # Attempt to send a message to the server
+            runner.run(client.client_handler())
 
-        # If successful, break out of the loop
-        break
+            # If successful, break out of the loop
+            break
 
-    except Exception as e:
-        # If the connection fails, print the error and retry
-        print(f"Connection failed: {e}. Retry...")
-        # Optionally, remove the existing .env file before retrying
-        create_dotenv(remove=True)
+        except Exception as e:
+            # If the connection fails, print the error and retry
+            print(f"Connection failed: {e}. Retry...")
+            # Optionally, remove the existing .env file before retrying
+            create_dotenv(remove=True)
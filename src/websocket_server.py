@@ -1,35 +1,170 @@
 import asyncio
+import json
+import logging
+import multiprocessing
+import os
 import websockets
+from broadcaster import Broadcaster, deflate_extensions
+import pubsub
+import runner
+from logs import get_logger
 
-# track connected clients
-connected = set()
+log = get_logger("chat_server")
 
+# number of server processes, above 1 they share the port with SO_REUSEPORT
+WORKERS = int(os.getenv("WORKERS", "1"))
+# unix socket the workers use to pass broadcasts to each other
+HUB_PATH = os.getenv("HUB_PATH", "/tmp/websocket_server_hub.sock")
 
-async def broadcast(message):
-    for websocket in connected:
-        await websocket.send(message)
+# room every client joins on connect, messages without a room go here
+DEFAULT_ROOM = "lobby"
+
+# track connected clients, each with its own outbound queue
+broadcaster = Broadcaster()
+# connection to the other workers, None when running a single process
+hub = None
+
+# room name -> connections in the room
+rooms = {}
+# connection -> names of the rooms it is in
+memberships = {}
+# username -> connection, for direct messages
+users = {}
+
+
+def join(websocket, room):
+    rooms.setdefault(room, set()).add(websocket)
+    memberships[websocket].add(room)
+
+
+def leave(websocket, room):
+    members = rooms.get(room)
+    if members is not None:
+        members.discard(websocket)
+        if not members:
+            del rooms[room]
+    memberships[websocket].discard(room)
+
+
+# deliver a chat message to this worker's clients, data is the parsed message
+def route(message, data):
+    to = data.get("to")
+    if to is not None:
+        # direct message, only the named user receives it
+        websocket = users.get(to)
+        if websocket is not None:
+            broadcaster.send(websocket, message)
+    else:
+        room = data.get("room", DEFAULT_ROOM)
+        broadcaster.publish(message, rooms.get(room, ()))
+
+
+def broadcast(message, data):
+    route(message, data)
+    if hub is not None:
+        # clients of the other workers may be in the room or be the recipient
+        hub.publish(message)
 
 
 # handle connected clients
 async def handler(websocket):
     # add the connected client
-    connected.add(websocket)
+    broadcaster.add(websocket)
+    memberships[websocket] = set()
+    join(websocket, DEFAULT_ROOM)
+    name = None
     try:
         # listen for messages from websocket
         async for message in websocket:
-            print(f"Message recieved:\n{message}")
-            # broadcast any message received to
-            await broadcast(message)
-    except Exception as e:
-        print(f"An error occurred: {e}")
+            log.sample("message_received", message=message)
+            # a malformed message is skipped, not a reason to drop the connection
+            try:
+                data = json.loads(message)
+            except ValueError:
+                data = None
+            if not isinstance(data, dict) or not all(
+                isinstance(data.get(field), (str, type(None))) for field in ("name", "to")
+            ):
+                log.sample("invalid_message", level=logging.WARNING, name=name, message=message)
+                continue
+
+            # the first name a connection uses is registered for direct messages
+            if name is None and data.get("name") is not None:
+                if users.setdefault(data["name"], websocket) is websocket:
+                    name = data["name"]
+
+            # control messages
+            message_type = data.get("type")
+            if message_type in ("join", "leave"):
+                room = data.get("room")
+                if not isinstance(room, str):
+                    log.sample("invalid_room", level=logging.WARNING, name=name, message=message)
+                elif message_type == "join":
+                    join(websocket, room)
+                else:
+                    leave(websocket, room)
+            else:
+                # only members can send to a room
+                room = data.get("room", DEFAULT_ROOM)
+                if data.get("to") is None and not (
+                    isinstance(room, str) and room in memberships[websocket]
+                ):
+                    log.sample("not_in_room", level=logging.WARNING, name=name, room=room)
+                    continue
+                # broadcast any message received to the room or recipient
+                broadcast(message, data)
+                # echo direct messages back to the sender, like room messages
+                to = data.get("to")
+                if to is not None and users.get(to) is not websocket:
+                    broadcaster.send(websocket, message)
+    except Exception:
+        log.exception("handler_failed", name=name)
     finally:
-        connected.remove(websocket)
+        for room in list(memberships[websocket]):
+            leave(websocket, room)
+        del memberships[websocket]
+        if name is not None:
+            del users[name]
+        broadcaster.remove(websocket)
+
+
+def serve(reuse_port=False):
+    return websockets.serve(
+        handler,
+        "localhost",
+        8765,
+        extensions=deflate_extensions(),
+        reuse_port=reuse_port,
+    )
 
 
 # main
 async def main():
-    async with websockets.serve(handler, "localhost", 8765):
+    async with serve():
         await asyncio.Future()
 
 
-asyncio.run(main())
+# main of each worker process
+async def worker_main():
+    global hub
+    hub = pubsub.HubClient()
+    await hub.connect(HUB_PATH)
+    async with serve(reuse_port=True):
+        # deliver broadcasts from clients of the other workers to this worker's clients
+        async for message in hub.messages():
+            route(message, json.loads(message))
+
+
+def run_worker():
+    runner.run(worker_main())
+
+
+if __name__ == "__main__":
+    if WORKERS > 1:
+        # listen before forking so workers can connect right away
+        sock = pubsub.listen(HUB_PATH)
+        for _ in range(WORKERS):
+            multiprocessing.Process(target=run_worker, daemon=True).start()
+        runner.run(pubsub.Hub().serve(sock))
+    else:
+        runner.run(main())